@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+"""Module with pooled connections to MySQL databases.
+
+Notes
+-----
+- A pool is created for each configuration from the module `dbconfig` and set
+  of additional connection options at the first request of a connection and
+  it is kept for the life time of the process.
+- Closing a pooled connection returns it to its pool. The pool checks
+  a returned connection at the next request and reconnects it transparently,
+  if the server has dropped it.
+- Pools are not shared among processes. A process should close all pools
+  before it forks workers.
+- Loading copies of tables (shadow tables) and replacing live tables with
+  them is shared by all scripts as well.
+
+"""
+__version__ = '0.1.0'
+__status__ = 'Beta'
+__author__ = 'Libor Gabaj'
+__copyright__ = 'Copyright 2019, ' + __author__
+__credits__ = [__author__]
+__license__ = 'MIT'
+__maintainer__ = __author__
+__email__ = 'libor.gabaj@gmail.com'
+
+# Standard library modules
+import logging
+import threading
+import time
+import mysql.connector as mysql
+import mysql.connector.pooling
+
+# Custom library modules
+import dbconfig as db
+import sql
+
+
+###############################################################################
+# Module global variables
+###############################################################################
+logger = logging.getLogger(__name__)
+
+
+###############################################################################
+# Enumeration and parameter classes
+###############################################################################
+class Pool:
+    """Pools of database connections and their usage statistics."""
+
+    (
+        pools, stats, lock, SIZE, TIMEOUT, WAIT,
+    ) = ({}, {}, threading.Lock(), 1, 30.0, 0.05,)
+
+
+###############################################################################
+# Actions
+###############################################################################
+def get_pool(name, size=None, **options):
+    """Find or create a pool of connections to a database.
+
+    Arguments
+    ---------
+    name : str
+        Name of a database configuration in the module `dbconfig` without
+        the suffix '_config', e.g., 'source' or 'target'.
+    size : int
+        Number of connections of a newly created pool. It is ignored for an
+        existing pool.
+    options : dict
+        Additional connection options extending the configuration.
+
+    Returns
+    -------
+    pool : object
+        Pool of connections to a database.
+
+    Raises
+    -------
+    mysql.connector.Error
+        Native exception of the database connector.
+
+    """
+    key = '.'.join([name] + sorted(options))
+    with Pool.lock:
+        if key not in Pool.pools:
+            config = dict(getattr(db, name + '_config'))
+            config.update(options)
+            size = min(max(size or Pool.SIZE, 1),
+                       mysql.pooling.CNX_POOL_MAXSIZE)
+            try:
+                Pool.pools[key] = mysql.pooling.MySQLConnectionPool(
+                    pool_name=key,
+                    pool_size=size,
+                    **config
+                )
+            except mysql.Error as err:
+                if err.errno == mysql.errorcode.ER_ACCESS_DENIED_ERROR:
+                    logger.error('Bad database %s credentials',
+                                 config['database'])
+                elif err.errno == mysql.errorcode.ER_BAD_DB_ERROR:
+                    logger.error('Database %s does not exist',
+                                 config['database'])
+                else:
+                    logger.error(err)
+                raise
+            Pool.stats[key] = {
+                'size': size,
+                'requests': 0,
+                'waits': 0,
+                'failures': 0,
+            }
+            logger.debug(
+                'Pool %s with %d connections to database %s created',
+                key,
+                size,
+                config['database']
+            )
+        return Pool.pools[key]
+
+
+def connect(name, size=None, **options):
+    """Get a pooled connection to a database.
+
+    Arguments
+    ---------
+    name : str
+        Name of a database configuration in the module `dbconfig` without
+        the suffix '_config', e.g., 'source' or 'target'.
+    size : int
+        Number of connections of a pool, if it is created by this request.
+    options : dict
+        Additional connection options extending the configuration.
+
+    Returns
+    -------
+    connection : object
+        Pooled connection object to a database. Closing it returns it to the
+        pool.
+
+    Raises
+    -------
+    mysql.connector.Error
+        Native exception of the database connector.
+
+    Notes
+    -----
+    - If all connections of a pool are in use, the request waits for
+      a returned connection up to a timeout.
+
+    """
+    pool = get_pool(name, size, **options)
+    stats = Pool.stats[pool.pool_name]
+    deadline = time.monotonic() + Pool.TIMEOUT
+    waiting = False
+    while True:
+        try:
+            conn = pool.get_connection()
+            break
+        except mysql.PoolError:
+            if time.monotonic() > deadline:
+                logger.error('Pool %s exhausted', pool.pool_name)
+                raise
+            if not waiting:
+                waiting = True
+                with Pool.lock:
+                    stats['waits'] += 1
+            time.sleep(Pool.WAIT)
+        except mysql.Error as err:
+            with Pool.lock:
+                stats['failures'] += 1
+            logger.error(err)
+            raise
+    with Pool.lock:
+        stats['requests'] += 1
+    return conn
+
+
+def statistics():
+    """Usage statistics of all pools.
+
+    Returns
+    -------
+    dict
+        Statistics keyed by pool names with number of connections of a pool,
+        connections currently in use, served requests, requests waiting for
+        a connection, and failed requests.
+
+    """
+    stats = {}
+    with Pool.lock:
+        for key, pool in Pool.pools.items():
+            stats[key] = dict(Pool.stats[key])
+            queue = getattr(pool, '_cnx_queue', None)
+            if queue is not None:
+                stats[key]['in_use'] = stats[key]['size'] - queue.qsize()
+    return stats
+
+
+def close():
+    """Close all idle connections of all pools and forget the pools.
+
+    Notes
+    -----
+    - The connector provides no public method for closing a pool. If its
+      internal method is not available, idle connections are closed, when
+      the forgotten pool is garbage collected.
+
+    """
+    with Pool.lock:
+        for key, pool in Pool.pools.items():
+            remove = getattr(pool, '_remove_connections', None)
+            if remove is None:
+                logger.debug('Pool %s left to garbage collection', key)
+                continue
+            try:
+                remove()
+            except mysql.Error as err:
+                logger.error(err)
+            logger.debug('Pool %s closed', key)
+        Pool.pools = {}
+        Pool.stats = {}
+
+
+###############################################################################
+# Table actions
+###############################################################################
+def table_exists(conn, table):
+    """Check whether a table exists in the current database.
+
+    Arguments
+    ---------
+    conn : object
+        Connection object to a database.
+    table : str
+        Real table name.
+
+    Returns
+    -------
+    boolean
+        Flag about existing table.
+
+    Raises
+    -------
+    mysql.connector.Error
+        Native exception of the database connector.
+
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql.compose_tablerows([table], 'ENGINE'))
+        return bool(cursor.fetchall())
+    finally:
+        cursor.close()
+
+
+def drop_table(conn, table):
+    """Drop a table, if it exists.
+
+    Arguments
+    ---------
+    conn : object
+        Connection object to a database.
+    table : str
+        Real table name.
+
+    Raises
+    -------
+    mysql.connector.Error
+        Native exception of the database connector.
+
+    Notes
+    -----
+    - The existence is checked in advance, because dropping a missing table
+      produces a note, which is raised as an error by connections raising
+      warnings.
+
+    """
+    if not table_exists(conn, table):
+        return
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql.compose_drop(table))
+    finally:
+        cursor.close()
+    logger.debug('Table %s dropped', table)
+
+
+def shadow_create(conn, table):
+    """Create an empty copy of a table for loading.
+
+    Arguments
+    ---------
+    conn : object
+        Connection object to a database.
+    table : str
+        Real name of a live table.
+
+    Returns
+    -------
+    str
+        Real name of the created copy. A previous copy is replaced.
+
+    Raises
+    -------
+    mysql.connector.Error
+        Native exception of the database connector.
+
+    """
+    shadow = table + sql.target_table_suffix_shadow
+    drop_table(conn, shadow)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql.compose_create_like(shadow, table))
+    finally:
+        cursor.close()
+    logger.debug('Table %s created for loading', shadow)
+    return shadow
+
+
+def shadow_swap(conn, table, shadow):
+    """Replace a live table with its loaded copy.
+
+    Arguments
+    ---------
+    conn : object
+        Connection object to a database.
+    table : str
+        Real name of a live table.
+    shadow : str
+        Real name of a loaded copy of the live table.
+
+    Raises
+    -------
+    mysql.connector.Error
+        Native exception of the database connector. The live table is kept
+        untouched in that case.
+
+    Notes
+    -----
+    - Both tables are renamed by a single atomic command, so that readers
+      see either the previous or the new content of the table. The previous
+      content is dropped afterwards.
+
+    """
+    old = table + sql.target_table_suffix_old
+    # Leftover of an interrupted replacement
+    drop_table(conn, old)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql.compose_swap(table, shadow, old))
+    finally:
+        cursor.close()
+    logger.debug('Table %s replaced with %s', table, shadow)
+    drop_table(conn, old)
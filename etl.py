@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 """Script for migrating individual code list or agenda table."""
-__version__ = '0.5.2'
+__version__ = '0.6.0'
 __status__ = 'Beta'
 __author__ = 'Libor Gabaj'
 __copyright__ = 'Copyright 2019, ' + __author__
@@ -12,12 +12,23 @@ __email__ = 'libor.gabaj@gmail.com'
 # Standard library modules
 import os
 import argparse
+import json
 import logging
+import queue
+import tempfile
+import threading
+import time
+import multiprocessing
+import multiprocessing.util
 import mysql.connector as mysql
 
 # Third party modules
 import dbconfig as db
+import dbpool
+import governor
 import sql
+import md
+import tf
 
 
 ###############################################################################
@@ -34,130 +45,995 @@ class Script:
     """Script parameters."""
 
     (
-        fullname, basename, name,
-    ) = ('', '', '',)
+        fullname, basename, name, watermarks,
+    ) = ('', '', '', '',)
 
 
 class Source:
     """Status parameters of the data source."""
 
     (
-        conn, query, cursor, table, database, root, ALL,
-    ) = (None, None, None, None, None, None, '*',)
+        conn, query, cursor, table, database, root, rows,
+        watermark, watermarks, ALL,
+    ) = (None, None, None, None, None, None, 0, None, {}, '*',)
+
+
+class Batch:
+    """Parameters of adaptive multi-row inserts."""
+
+    (
+        size, latency, packet, MIN, MAX, PACKET, PACKET_USAGE,
+    ) = (1000, 0.5, None, 10, 50000, 1048576, 0.8,)
+
+
+class Sync:
+    """Parameters of synchronization by checksums of ranges of records."""
+
+    (
+        ranges, deleted, RANGE, SPLIT, LEAF,
+    ) = (0, 0, 65536, 16, 64,)
 
 
 class Target:
     """Status parameters of the data target."""
 
     (
-        conn, query, cursor, table, database, root, register,
-    ) = (None, None, None, None, None, None, None,)
+        conn, query, cursor, table, database, root, register, rows, elapsed,
+        registered, bulk, load, BULK_ERRORS,
+    ) = (None, None, None, None, None, None, None, 0, 0.0,
+         {}, None, None, (1148, 2068, 3948),)
 
 
 ###############################################################################
 # Actions
 ###############################################################################
-def connect_db(config):
-    """Connect to a database.
+def source_open():
+    """Connect to a source database.
+
+    Returns
+    -------
+    boolean
+        Flag about successful processing.
+
+    """
+    if Source.conn is None:
+        try:
+            Source.conn = governor.govern(dbpool.connect('source'))
+        except Exception:
+            logger.error(
+                'Cannot connect to the source database %s',
+                Source.database
+                )
+            return False
+    return True
+
+
+def source_close():
+    """Close cursor and connection to a source database."""
+    # Close cursor
+    if Source.cursor is not None:
+        Source.cursor.close()
+    # Close connection to database
+    if Source.conn is not None:
+        Source.conn.close()
+    Source.conn = None
+    Source.query = None
+    Source.cursor = None
+    Source.table = None
+
+
+def target_open():
+    """Connect to a target database.
+
+    Returns
+    -------
+    boolean
+        Flag about successful processing.
+
+    """
+    if Target.conn is None:
+        options = {}
+        if cmdline.bulk:
+            options['allow_local_infile'] = True
+        try:
+            Target.conn = dbpool.connect('target', **options)
+        except Exception:
+            logger.error(
+                'Cannot connect to the target database %s',
+                Target.database
+                )
+            return False
+    return True
+
+
+def target_close():
+    """Close cursor and connection to a target database."""
+    # Close cursor
+    if Target.cursor is not None:
+        Target.cursor.close()
+    # Close connection to database
+    if Target.conn is not None:
+        Target.conn.close()
+    Target.conn = None
+    Target.query = None
+    Target.cursor = None
+    Target.table = None
+    Target.load = None
+
+
+def read_source(mark=None):
+    """Read records of the current source table.
 
     Arguments
     ---------
-    config : dict
-        Connection configuration to a database.
+    mark : dict
+        High-water mark of the previous migration with keys 'timestamp' and
+        'id'. If provided, only records created or modified after it are read.
+
+    Yields
+    ------
+    list of dict
+        Chunk of source records. Without chunking the entire table is read
+        as a single chunk. The high-water mark of the source table is moved
+        after each chunk.
+
+    Raises
+    -------
+    mysql.connector.Error
+        Native exception of the database connector.
+
+    Notes
+    -----
+    - Chunks are paginated by the primary key of the source table (keyset
+      pagination), so that every chunk is read by a short indexed query
+      and only one chunk is held in memory at a time.
+
+    """
+    key = sql.source_table_key
+    params = {'last': None}
+    conditions = []
+    if mark is not None:
+        params.update({
+            'mark_timestamp': mark['timestamp'],
+            'mark_id': mark['id'],
+            })
+        conditions.append(sql.source_table_watermark_newer)
+    while True:
+        where = conditions
+        if params['last'] is not None:
+            where = conditions + [f'{key} > %(last)s']
+        Source.query = sql.compose_select(
+            table=Source.table,
+            fields=sql.source[Source.table]['fields'],
+            where=' AND '.join(where),
+            order=key if cmdline.chunk else None,
+            limit=cmdline.chunk,
+            )
+        Source.cursor = Source.conn.cursor(dictionary=True)
+        with governor.query(Source.conn, Source.query) as query:
+            Source.cursor.execute(Source.query, params)
+            records = Source.cursor.fetchall()
+            query.rows = len(records)
+        Source.cursor.close()
+        if not records:
+            break
+        Source.rows += len(records)
+        Source.watermark = update_watermark(Source.watermark, records)
+        logger.debug(
+            'Read %d records from table %s.%s',
+            len(records),
+            Source.database,
+            Source.table
+            )
+        yield records
+        if not cmdline.chunk or len(records) < cmdline.chunk:
+            break
+        params['last'] = records[-1][key]
+
+
+def read_ahead(chunks):
+    """Produce chunks of source records concurrently with their consuming.
+
+    Arguments
+    ---------
+    chunks : iterable of list of dict
+        Chunks of source records.
+
+    Yields
+    ------
+    list of dict
+        Chunk of source records read by a separate thread.
+
+    Raises
+    -------
+    mysql.connector.Error
+        Native exception of the database connector raised in the thread.
+
+    Notes
+    -----
+    - The thread reads at most the number of chunks from the command line
+      ahead of the consumer and then waits for it. Without read ahead chunks
+      are read and consumed alternately.
+    - The thread uses only the source connection, while the consumer uses
+      only the target one.
+
+    """
+    if not cmdline.read_ahead:
+        yield from chunks
+        return
+    buffer = queue.Queue(maxsize=cmdline.read_ahead)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for records in chunks:
+                if not put(records):
+                    return
+            put(done)
+        except Exception as err:
+            put(err)
+
+    thread = threading.Thread(target=produce, name='read_ahead', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def transform_source(chunks):
+    """Compute derived fields of the current target table in Python.
+
+    Arguments
+    ---------
+    chunks : iterable of list of dict
+        Chunks of source records.
+
+    Yields
+    ------
+    list of dict
+        Chunk of source records extended with derived fields, if the
+        transformation is requested.
+
+    """
+    transforms = sql.target[Target.table].get('transforms')
+    for records in chunks:
+        if cmdline.transform:
+            tf.transform(records, transforms)
+        yield records
+
+
+def target_fields():
+    """Fields list for inserting to the current target table.
 
     Returns
     -------
-    connection : object
-        Connection object to a database.
+    str
+        Fields of the target table including user stamps.
+
+    """
+    return sql.target[Target.table]['fields'] + ', ' + sql.target_users_fields
+
+
+def target_values(plain=None):
+    """Values template for inserting to the current target table.
+
+    Arguments
+    ---------
+    plain : bool
+        Flag about replacing expressions of fields derived in Python with
+        plain placeholders, default according to the command line.
+
+    Returns
+    -------
+    str
+        Values template of the target table including the user id for user
+        stamps, so that records are stamped by the insert itself.
+
+    """
+    if plain is None:
+        plain = cmdline.transform
+    target = sql.target[Target.table]
+    values = target['values']
+    if plain and target.get('transforms'):
+        values = sql.compose_values_plain(
+            target['fields'],
+            target['values'],
+            target['transforms'],
+            )
+    return values + ', ' + sql.target_users_values.format(user=cmdline.user)
+
+
+def colocated():
+    """Check whether source and target databases are on the same server.
+
+    Returns
+    -------
+    boolean
+        Flag about the same host and port of both database configurations.
+
+    """
+    def address(config):
+        return config.get('host', 'localhost'), int(config.get('port', 3306))
+    return address(db.source_config) == address(db.target_config)
+
+
+def push_down(mark=None):
+    """Copy the current source table to the target one within the server.
+
+    Arguments
+    ---------
+    mark : dict
+        High-water mark of the previous migration. If provided, only records
+        created or modified after it are copied and upserted.
+
+    Returns
+    -------
+    boolean
+        Flag about successful processing.
 
     Raises
     -------
     mysql.connector.Error
-        Native exception of the database connector.
+        Native exception of the database connector at reading the new
+        high-water mark.
+
+    Notes
+    -----
+    - No record is transferred through the client. The command is executed
+      on the target connection, so its user needs read access to the source
+      database.
 
     """
+    where = None
+    params = {}
+    if mark is not None:
+        where = sql.source_table_watermark_newer
+        params = {
+            'mark_timestamp': mark['timestamp'],
+            'mark_id': mark['id'],
+            }
+    # New high-water mark before copying, newer records are copied again
+    if cmdline.incremental:
+        Source.query = sql.compose_select(
+            table=Source.table,
+            fields=f'MAX({sql.source_table_watermark}),'
+                   f' MAX({sql.source_table_key})',
+            where=where,
+            )
+        Source.cursor = Source.conn.cursor()
+        try:
+            with governor.query(Source.conn):
+                Source.cursor.execute(Source.query, params)
+                timestamp, key = Source.cursor.fetchone()
+        finally:
+            Source.cursor.close()
+        if key is not None:
+            Source.watermark = update_watermark(mark, [{
+                'created': timestamp,
+                'modified': None,
+                sql.source_table_key: key,
+                }])
+    Target.query = sql.compose_pushdown(
+        table=sql.compose_qualified(Target.database, Target.load),
+        fields=target_fields(),
+        values=target_values(plain=False),
+        source=sql.compose_qualified(Source.database, Source.table),
+        source_fields=sql.source[Source.table]['fields'],
+        where=where,
+        upsert=mark is not None,
+        )
+    Target.cursor = Target.conn.cursor()
+    start = time.perf_counter()
     try:
-        conn = mysql.connect(**config)
-        logger.debug('Database %s connected', config['database'])
-        return conn
+        Target.cursor.execute(Target.query, params)
+        Target.conn.commit()
     except mysql.Error as err:
-        if err.errno == mysql.errorcode.ER_ACCESS_DENIED_ERROR:
-            logger.error('Bad database %s credentials', config['database'])
-        elif err.errno == mysql.errorcode.ER_BAD_DB_ERROR:
-            logger.error('Database %s does not exist', config['database'])
+        logger.error(err)
+        return False
+    finally:
+        Target.elapsed += time.perf_counter() - start
+    Source.rows = Target.rows = Target.cursor.rowcount
+    logger.debug(
+        'Copied %d records to table %s.%s within the server',
+        Target.cursor.rowcount,
+        Target.database,
+        Target.table
+        )
+    return True
+
+
+def packet_size():
+    """Determine maximal size of a statement accepted by the target server.
+
+    Returns
+    -------
+    int
+        Value of the server variable max_allowed_packet in bytes.
+
+    """
+    if Batch.packet is None:
+        cursor = Target.conn.cursor()
+        try:
+            cursor.execute('SELECT @@max_allowed_packet')
+            Batch.packet = int(cursor.fetchone()[0])
+        except mysql.Error as err:
+            logger.error(err)
+            Batch.packet = Batch.PACKET
+        finally:
+            cursor.close()
+    return Batch.packet
+
+
+def insert_batches(query, values, records):
+    """Insert records by multi-row insert commands of adaptive size.
+
+    Arguments
+    ---------
+    query : function
+        Composer of a command for the provided number of rows.
+    values : str
+        Values template of a row with named placeholders.
+    records : list of dict
+        Source records for inserting.
+
+    Returns
+    -------
+    int
+        Number of inserted records.
+
+    Raises
+    -------
+    mysql.connector.Error
+        Native exception of the database connector.
+
+    Notes
+    -----
+    - The number of rows in a command is doubled, while a command is
+      executed in less than half of the target latency, and halved, when it
+      exceeds it.
+    - Rows are added to a command only while its estimated size fits into
+      the server's max_allowed_packet.
+
+    """
+    keys = sql.compose_placeholders(values)[1]
+    limit = packet_size() * Batch.PACKET_USAGE
+    inserted = 0
+    cursor = Target.conn.cursor()
+    try:
+        while inserted < len(records):
+            params = []
+            length = len(query(1))
+            rows = 0
+            for record in records[inserted:inserted + Batch.size]:
+                row = [record[k] for k in keys]
+                length += len(values) + sum([len(str(v)) for v in row]) * 2
+                if rows and length > limit:
+                    break
+                params.extend(row)
+                rows += 1
+            start = time.perf_counter()
+            cursor.execute(query(rows), params)
+            elapsed = time.perf_counter() - start
+            inserted += rows
+            if rows == Batch.size and elapsed < Batch.latency / 2:
+                Batch.size = min(Batch.size * 2, Batch.MAX)
+            elif elapsed > Batch.latency:
+                Batch.size = max(Batch.size // 2, Batch.MIN)
+    finally:
+        cursor.close()
+    return inserted
+
+
+def write_target(records, upsert=False):
+    """Insert records to the current target table.
+
+    Arguments
+    ---------
+    records : list of dict
+        Source records for inserting.
+    upsert : bool
+        Flag about updating already existing records instead of failing.
+
+    Returns
+    -------
+    boolean
+        Flag about successful processing.
+
+    """
+    compose = sql.compose_upsert if upsert else sql.compose_insert
+    fields = target_fields()
+    values = target_values()
+    start = time.perf_counter()
+    try:
+        if cmdline.batch:
+            positional = sql.compose_placeholders(values)[0]
+            rows = insert_batches(
+                lambda n: compose(Target.load, fields, positional, rows=n),
+                values,
+                records,
+                )
         else:
+            Target.query = compose(Target.load, fields, values)
+            Target.cursor = Target.conn.cursor()
+            Target.cursor.executemany(Target.query, records)
+            rows = Target.cursor.rowcount
+        Target.conn.commit()
+        Target.rows += rows
+        logger.debug(
+            'Inserted %d records to table %s.%s',
+            rows,
+            Target.database,
+            Target.table
+            )
+    except mysql.Error as err:
+        logger.error(err)
+        return False
+    finally:
+        Target.elapsed += time.perf_counter() - start
+    return True
+
+
+def local_infile():
+    """Check whether the target server accepts local files for bulk loading.
+
+    Returns
+    -------
+    boolean
+        Value of the server variable local_infile.
+
+    """
+    cursor = Target.conn.cursor()
+    try:
+        cursor.execute('SELECT @@local_infile')
+        return bool(int(cursor.fetchone()[0]))
+    except mysql.Error as err:
+        logger.error(err)
+        return False
+    finally:
+        cursor.close()
+
+
+def load_bulk(chunks, replace=False):
+    """Load records to the current target table by the server bulk loader.
+
+    Arguments
+    ---------
+    chunks : iterable of list of dict
+        Chunks of source records for loading.
+    replace : bool
+        Flag about replacing already existing records instead of skipping.
+
+    Returns
+    -------
+    boolean
+        Flag about successful processing or None, if bulk loading is not
+        available and records should be inserted by other way.
+
+    Raises
+    -------
+    mysql.connector.Error
+        Native exception of the database connector at reading records.
+
+    Notes
+    -----
+    - Records are streamed to a temporary tab separated file in the order of
+      placeholders of the target values template. Expressions of the template
+      are evaluated by the SET clause of the load command.
+
+    """
+    if Target.bulk is None:
+        Target.bulk = local_infile()
+        if not Target.bulk:
+            logger.warning(
+                'Server of database %s does not accept local files,'
+                ' inserting records instead',
+                Target.database
+                )
+            return None
+    values = target_values()
+    keys = sql.compose_columns(values)
+    file = tempfile.NamedTemporaryFile(
+        mode='w', encoding='utf-8', newline='',
+        prefix=Target.table + '_', suffix='.tsv', delete=False
+        )
+    try:
+        with file:
+            for records in chunks:
+                file.writelines([
+                    '\t'.join([sql.escape_tsv(r[k]) for k in keys]) + '\n'
+                    for r in records
+                    ])
+        Target.query = sql.compose_load(
+            table=Target.load,
+            fields=target_fields(),
+            values=values,
+            file=file.name,
+            replace=replace,
+            )
+        Target.cursor = Target.conn.cursor()
+        start = time.perf_counter()
+        try:
+            Target.cursor.execute(Target.query)
+            Target.conn.commit()
+        except mysql.Error as err:
+            if err.errno in Target.BULK_ERRORS:
+                Target.bulk = False
+                logger.warning(
+                    'Local files not allowed (%s), inserting records instead',
+                    err
+                    )
+                return None
             logger.error(err)
-        raise
+            return False
+        finally:
+            Target.elapsed += time.perf_counter() - start
+        Target.rows += Target.cursor.rowcount
+        logger.debug(
+            'Loaded %d records to table %s.%s',
+            Target.cursor.rowcount,
+            Target.database,
+            Target.table
+            )
+    finally:
+        os.remove(file.name)
+    return True
+
+
+def update_watermark(mark, records):
+    """Move a high-water mark after the provided records.
+
+    Arguments
+    ---------
+    mark : dict
+        Current high-water mark or None.
+    records : list of dict
+        Migrated source records.
+
+    Returns
+    -------
+    dict
+        Updated high-water mark with the latest modification datetime as
+        a string and the greatest primary key.
+
+    """
+    timestamps = [
+        max(filter(None, (r['modified'], r['created'])), default=None)
+        for r in records
+        ]
+    timestamps = [str(t) for t in timestamps if t is not None]
+    ids = [r[sql.source_table_key] for r in records]
+    if mark is not None:
+        timestamps.append(mark['timestamp'])
+        ids.append(mark['id'])
+    return {
+        'timestamp': max(timestamps, default=None),
+        'id': max(ids, default=None),
+        }
+
+
+def load_watermarks():
+    """Read high-water marks of incremental migrations from a file.
+
+    Returns
+    -------
+    dict
+        High-water marks keyed by source table names.
+
+    """
+    try:
+        with open(Script.watermarks, encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as err:
+        logger.error('Cannot read watermarks %s: %s', Script.watermarks, err)
+        return {}
+
+
+def save_watermarks():
+    """Write high-water marks of incremental migrations to a file."""
+    try:
+        with open(Script.watermarks, 'w', encoding='utf-8') as file:
+            json.dump(Source.watermarks, file, indent=2, sort_keys=True)
+    except OSError as err:
+        logger.error('Cannot write watermarks %s: %s', Script.watermarks, err)
+
+
+def is_stale():
+    """Check whether the current target table differs from the source one.
+
+    Returns
+    -------
+    boolean
+        Flag about different latest modification datetimes or numbers of
+        records of the source and target table. It is true, if they cannot
+        be determined.
+
+    """
+    table = {}
+    try:
+        for side, cls in (('source', Source), ('target', Target)):
+            timestamp, count = md.probe(cls.conn, cls.table)
+            table[f'{side}_timestamp'] = timestamp
+            table[f'{side}_count'] = count
+    except mysql.Error as err:
+        logger.error(err)
+        return True
+    return md.is_stale(table)
+
+
+def shadow_open():
+    """Create an empty copy of the current target table for loading.
+
+    Returns
+    -------
+    boolean
+        Flag about successful processing.
+
+    """
+    try:
+        Target.load = dbpool.shadow_create(Target.conn, Target.table)
+    except mysql.Error as err:
+        logger.error(err)
+        return False
+    return True
+
+
+def shadow_drop(table):
+    """Drop a copy of the current target table.
+
+    Arguments
+    ---------
+    table : str
+        Real name of a dropped copy.
+
+    """
+    try:
+        dbpool.drop_table(Target.conn, table)
+    except mysql.Error as err:
+        logger.error(err)
+    Target.load = Target.table
+
+
+def shadow_swap():
+    """Replace the current target table with its loaded copy.
+
+    Returns
+    -------
+    boolean
+        Flag about successful processing.
+
+    """
+    try:
+        dbpool.shadow_swap(Target.conn, Target.table, Target.load)
+    except mysql.Error as err:
+        logger.error(err)
+        shadow_drop(Target.load)
+        return False
+    logger.debug(
+        'Table %s.%s replaced with its loaded copy',
+        Target.database,
+        Target.table
+        )
+    Target.load = Target.table
+    return True
+
+
+def differing_ranges(size, first=None, last=None):
+    """Find ranges of primary keys with different source and target records.
+
+    Arguments
+    ---------
+    size : int
+        Number of primary keys in a range.
+    first : int
+        Optional first primary key of checked records.
+    last : int
+        Optional last primary key of checked records.
+
+    Returns
+    -------
+    list of int
+        Sorted numbers of differing ranges.
+
+    Raises
+    -------
+    mysql.connector.Error
+        Native exception of the database connector.
+
+    """
+    where = None
+    params = None
+    if first is not None:
+        where = sql.source_table_range
+        params = {'range_first': first, 'range_last': last}
+    mapping = sql.compose_mapping(Source.table)
+    source_sums, target_sums = md.both_sides(
+        md.checksum_side,
+        (Source.conn, Source.table, [m[1] for m in mapping], size, where,
+         params),
+        (Target.conn, Target.table, [m[0] for m in mapping], size, where,
+         params),
+        )
+    return sorted([
+        range_id
+        for range_id in set(source_sums) | set(target_sums)
+        if source_sums.get(range_id) != target_sums.get(range_id)
+        ])
+
+
+def sync_range(first, last):
+    """Copy source records of a range of primary keys to the target table.
+
+    Arguments
+    ---------
+    first : int
+        First primary key of the range.
+    last : int
+        Last primary key of the range.
+
+    Returns
+    -------
+    boolean
+        Flag about successful processing.
+
+    Raises
+    -------
+    mysql.connector.Error
+        Native exception of the database connector.
+
+    Notes
+    -----
+    - Source records are upserted and target records missing in the source
+      table are deleted.
+
+    """
+    key = sql.source_table_key
+    params = {'range_first': first, 'range_last': last}
+    Source.query = sql.compose_select(
+        table=Source.table,
+        fields=sql.source[Source.table]['fields'],
+        where=sql.source_table_range,
+        )
+    Source.cursor = Source.conn.cursor(dictionary=True)
+    try:
+        with governor.query(Source.conn, Source.query) as query:
+            Source.cursor.execute(Source.query, params)
+            records = Source.cursor.fetchall()
+            query.rows = len(records)
+    finally:
+        Source.cursor.close()
+    Source.rows += len(records)
+    success = True
+    for records in transform_source([records] if records else []):
+        success = write_target(records, upsert=True)
+    # Delete records missing in the source table
+    where = sql.source_table_range
+    if records:
+        ids = ', '.join([str(int(r[key])) for r in records])
+        where += f' AND {key} NOT IN ({ids})'
+    Target.query = sql.compose_delete(Target.table, where)
+    Target.cursor = Target.conn.cursor()
+    try:
+        Target.cursor.execute(Target.query, params)
+        Target.conn.commit()
+        Sync.deleted += Target.cursor.rowcount
+    except mysql.Error as err:
+        logger.error(err)
+        return False
+    logger.debug(
+        'Synchronized records with %s %d-%d in table %s.%s',
+        key, first, last,
+        Target.database,
+        Target.table
+        )
+    return success
 
 
-def source_open():
-    """Connect to a source database.
+def key_bounds():
+    """Determine the lowest and highest primary key of the current tables.
 
     Returns
     -------
-    boolean
-        Flag about successful processing.
+    tuple
+        The lowest and highest primary key in the source and target table
+        together, or a pair of None for empty tables.
+
+    Raises
+    -------
+    mysql.connector.Error
+        Native exception of the database connector.
 
     """
-    if Source.conn is None:
+    key = sql.source_table_key
+    fields = f'MIN({key}), MAX({key})'
+    bounds = []
+    for conn, table in [(Source.conn, Source.table),
+                        (Target.conn, Target.table)]:
+        cursor = conn.cursor()
         try:
-            Source.conn = connect_db(db.source_config)
-        except Exception:
-            logger.error(
-                'Cannot connect to the source database %s',
-                Source.database
-                )
-            return False
-    return True
-
+            with governor.query(conn):
+                cursor.execute(sql.compose_select(table, fields))
+                low, high = cursor.fetchone()
+        finally:
+            cursor.close()
+        if low is not None:
+            bounds.append((low, high))
+    if not bounds:
+        return None, None
+    return min([b[0] for b in bounds]), max([b[1] for b in bounds])
 
-def source_close():
-    """Close cursor and connection to a source database."""
-    # Close cursor
-    if Source.cursor is not None:
-        Source.cursor.close()
-    # Close connection to database
-    if Source.conn is not None:
-        Source.conn.close()
-    Source.conn = None
-    Source.query = None
-    Source.cursor = None
-    Source.table = None
 
+def sync(size=None, first=None, last=None):
+    """Synchronize the current target table with the source one.
 
-def target_open():
-    """Connect to a target database.
+    Arguments
+    ---------
+    size : int
+        Number of primary keys in a compared range, default initial one.
+    first : int
+        Optional first primary key of synchronized records.
+    last : int
+        Optional last primary key of synchronized records.
 
     Returns
     -------
     boolean
         Flag about successful processing.
 
-    """
-    if Target.conn is None:
-        try:
-            Target.conn = connect_db(db.target_config)
-        except Exception:
-            logger.error(
-                'Cannot connect to the target database %s',
-                Target.database
-                )
-            return False
-    return True
+    Raises
+    -------
+    mysql.connector.Error
+        Native exception of the database connector.
 
+    Notes
+    -----
+    - Ranges are compared by checksums computed by database servers. Each
+      differing range is split into smaller ones recursively, until it has
+      at most the leaf size, and only records of such ranges are copied.
+    - With chunked reading the tables are compared by windows of primary keys
+      of about the chunk size instead of by entire tables at once.
 
-def target_close():
-    """Close cursor and connection to a target database."""
-    # Close cursor
-    if Target.cursor is not None:
-        Target.cursor.close()
-    # Close connection to database
-    if Target.conn is not None:
-        Target.conn.close()
-    Target.conn = None
-    Target.query = None
-    Target.cursor = None
-    Target.table = None
+    """
+    size = size or Sync.RANGE
+    success = True
+    # Compare windows of chunk size at limited rate of reading
+    if first is None and cmdline.chunk and cmdline.chunk < size:
+        window = max(cmdline.chunk // Sync.LEAF, 1) * Sync.LEAF
+        low, high = key_bounds()
+        if low is None:
+            return success
+        for range_first in range(low - low % window, high + 1, window):
+            success &= sync(window, range_first, range_first + window - 1)
+        return success
+    for range_id in differing_ranges(size, first, last):
+        range_first = range_id * size
+        range_last = range_first + size - 1
+        if size <= Sync.LEAF:
+            Sync.ranges += 1
+            success &= sync_range(range_first, range_last)
+        else:
+            success &= sync(
+                max(size // Sync.SPLIT, Sync.LEAF), range_first, range_last)
+    return success
 
 
 def migrate():
@@ -176,105 +1052,318 @@ def migrate():
             Source.database, Source.table
             )
         return False
-    # Read source table
-    Source.query = sql.compose_select(
-        table=Source.table,
-        fields=sql.source[Source.table]['fields'],
-        )
-    Source.cursor = Source.conn.cursor(dictionary=True)
-    try:
-        Source.cursor.execute(Source.query)
-        records = Source.cursor.fetchall()
-        logger.debug(
-            'Read %d records from table %s.%s',
-            Source.cursor.rowcount,
+    Target.table = sql.source[Source.table]['table_target']
+    if cmdline.only_stale and not is_stale():
+        logger.info(
+            'Table %s.%s is up to date with %s.%s and skipped',
+            Target.database,
+            Target.table,
             Source.database,
-            Source.table
+            Source.table,
             )
-    except mysql.Error as err:
-        logger.error(err)
-        return False
-    # Truncate target table
-    Target.table = sql.source[Source.table]['table_target']
-    Target.query = sql.compose_truncate(Target.table)
-    Target.cursor = Target.conn.cursor()
-    try:
-        Target.cursor.execute(Target.query)
-        logger.debug(
-            'Table %s.%s truncated',
+        return True
+    # Synchronize differing ranges of records only
+    Target.load = Target.table
+    if cmdline.sync:
+        Source.rows = Target.rows = 0
+        Target.elapsed = 0.0
+        Sync.ranges = Sync.deleted = 0
+        try:
+            if not sync():
+                return False
+        except mysql.Error as err:
+            logger.error(err)
+            return False
+        logger.info(
+            'Table %s.%s synchronized with %s.%s in %d ranges'
+            ' with %d upserted and %d deleted records',
             Target.database,
-            Target.table
+            Target.table,
+            Source.database,
+            Source.table,
+            Sync.ranges,
+            Target.rows,
+            Sync.deleted,
             )
+        return True
+    mark = None
+    if cmdline.incremental:
+        mark = Source.watermarks.get(Source.table)
+    # Empty target table unless it is migrated incrementally
+    if mark is None:
+        if cmdline.shadow:
+            if not shadow_open():
+                return False
+        else:
+            Target.query = sql.compose_truncate(Target.table)
+            Target.cursor = Target.conn.cursor()
+            try:
+                Target.cursor.execute(Target.query)
+                logger.debug(
+                    'Table %s.%s truncated',
+                    Target.database,
+                    Target.table
+                    )
+            except mysql.Error as err:
+                logger.error(err)
+                return False
+    # Copy source table to target table chunk by chunk
+    Source.rows = Target.rows = 0
+    Target.elapsed = 0.0
+    Source.watermark = mark
+    success = None
+    try:
+        if cmdline.pushdown:
+            success = push_down(mark)
+        elif cmdline.bulk and Target.bulk is not False:
+            success = load_bulk(
+                read_ahead(transform_source(read_source(mark))),
+                replace=mark is not None,
+                )
+        if success is None:
+            Source.rows = Target.rows = 0
+            Source.watermark = mark
+            success = True
+            for records in read_ahead(transform_source(read_source(mark))):
+                success &= write_target(records, upsert=mark is not None)
     except mysql.Error as err:
         logger.error(err)
+        success = False
+    # Replace target table with its loaded copy
+    if Target.load != Target.table:
+        if not success:
+            shadow_drop(Target.load)
+        elif not shadow_swap():
+            success = False
+    if not success:
+        Source.watermark = None
         return False
-    # Insert to target table
-    Target.query = sql.compose_insert(
-        table=Target.table,
-        fields=sql.target[Target.table]['fields'],
-        values=sql.target[Target.table]['values'],
+    # Success
+    logger.info(
+        'Table %s.%s migrated to %s.%s with %d records under user %d',
+        Source.database,
+        Source.table,
+        Target.database,
+        Target.table,
+        Source.rows,
+        cmdline.user,
         )
-    Target.cursor = Target.conn.cursor()
-    try:
-        Target.cursor.executemany(Target.query, records)
-        logger.debug(
-            'Inserted %d records to table %s.%s',
-            Target.cursor.rowcount,
+    if Target.elapsed:
+        logger.info(
+            'Inserted %d records to table %s.%s at %.0f rows/s',
+            Target.rows,
             Target.database,
-            Target.table
+            Target.table,
+            Target.rows / Target.elapsed,
             )
-    except mysql.Error as err:
-        logger.error(err)
-        # return False
-    # Update user in target table
-    Target.query = sql.compose_update(
-        table=Target.table,
-        fields=sql.target_users,
-        )
-    Target.cursor = Target.conn.cursor()
+    return True
+
+
+def source_tables(table_prefix, table_roots):
+    """List source tables requested from the command line.
+
+    Arguments
+    ---------
+    table_prefix : str
+        Prefix of tables.
+    table_roots : str
+        Comma separated list of table roots or asterisk for all supported.
+
+    Returns
+    -------
+    list of str
+        Real source table names.
+
+    """
+    if table_roots == Source.ALL:
+        return [k for k in sql.source if k.startswith(table_prefix)]
+    return [
+        sql.compose_table(table_prefix, root)
+        for root in table_roots.split(',')
+        ]
+
+
+def schedule(jobs):
+    """Sort migration jobs by size of their source tables, largest first.
+
+    Arguments
+    ---------
+    jobs : list of tuple
+        Migration jobs as pairs of a source table and a registration table.
+
+    Returns
+    -------
+    list of tuple
+        Sorted migration jobs.
+
+    Notes
+    -----
+    - The size of a table is an estimate from the information schema, so that
+      scheduling does not scan the tables.
+
+    """
+    tables = [job[0] for job in jobs if job[0] in sql.source]
+    if not tables:
+        return jobs
+    Source.query = sql.compose_tablerows(tables)
+    Source.cursor = Source.conn.cursor()
     try:
-        Target.cursor.execute(Target.query, {'user': cmdline.user})
-        logger.debug(
-            'Updated %d records in table %s.%s',
-            Target.cursor.rowcount,
-            Target.database,
-            Target.table
-            )
+        with governor.query(Source.conn):
+            Source.cursor.execute(Source.query)
+            records = Source.cursor.fetchall()
     except mysql.Error as err:
         logger.error(err)
-        return False
-    # Update user in registration table
-    if Target.register:
+        return jobs
+    finally:
+        Source.cursor.close()
+    sizes = {}
+    for name, count in records:
+        if isinstance(name, (bytes, bytearray)):
+            name = name.decode()
+        sizes[name] = count or 0
+    return sorted(jobs, key=lambda job: sizes.get(job[0], 0), reverse=True)
+
+
+def migrate_job(job):
+    """Migrate a source table within a worker.
+
+    Arguments
+    ---------
+    job : tuple
+        Pair of a source table and a registration table or None.
+
+    Returns
+    -------
+    tuple
+        Migration job, flag about successful processing, and new high-water
+        mark of the table or None.
+
+    """
+    Source.table, Target.register = job
+    Source.watermark = None
+    if not (source_open() and target_open()):
+        return job, False, None
+    success = migrate()
+    return job, success, Source.watermark
+
+
+def record_job(result):
+    """Record the result of a migration job.
+
+    Arguments
+    ---------
+    result : tuple
+        Result of a migration job returned by :func:`migrate_job`.
+
+    """
+    (table, register), success, mark = result
+    if not success:
+        logger.warning('Table %s.%s not migrated', Source.database, table)
+        return
+    if mark is not None:
+        Source.watermarks[table] = mark
+    if register:
+        Target.registered.setdefault(register, []).append(
+            sql.source[table]['table_target'])
+
+
+def update_register():
+    """Update user in registration tables for all migrated tables at once.
+
+    Returns
+    -------
+    boolean
+        Flag about successful processing.
+
+    """
+    for register, tables in Target.registered.items():
         Target.query = sql.compose_update_register(
-            register=Target.register,
-            table=Target.table,
+            register=register,
+            tables=tables,
             fields=sql.target_users,
             )
         Target.cursor = Target.conn.cursor()
         try:
             Target.cursor.execute(Target.query, {'user': cmdline.user})
+            Target.conn.commit()
             logger.debug(
                 'Updated %d records in table %s.%s',
                 Target.cursor.rowcount,
                 Target.database,
-                Target.register
+                register
                 )
         except mysql.Error as err:
             logger.error(err)
             return False
-    # Success
-    logger.info(
-        'Table %s.%s migrated to %s.%s with %d records under user %d',
-        Source.database,
-        Source.table,
-        Target.database,
-        Target.table,
-        Source.cursor.rowcount,
-        cmdline.user,
-        )
+    Target.registered = {}
     return True
 
 
+def worker_init(args, semaphore=None):
+    """Initialize a worker process of parallel migration.
+
+    Arguments
+    ---------
+    args : object
+        Command line arguments of the parent process.
+    semaphore : object
+        Semaphore limiting concurrent source queries of all workers.
+
+    Notes
+    -----
+    - Each worker has its own connection pools. It gets connections on its
+      first job and keeps them for the following ones.
+    - Each worker reads its share of the source rate limit.
+
+    """
+    global cmdline
+    cmdline = args
+    setup_params()
+    setup_logger()
+    governor.configure(
+        rate=cmdline.rate / cmdline.jobs if cmdline.rate else None,
+        timeout=cmdline.statement_time,
+        semaphore=semaphore,
+        )
+    Source.database = db.source_config['database']
+    Target.database = db.target_config['database']
+    Source.conn = Target.conn = None
+    Source.cursor = Target.cursor = None
+    if cmdline.incremental:
+        Source.watermarks = load_watermarks()
+    multiprocessing.util.Finalize(None, source_close, exitpriority=10)
+    multiprocessing.util.Finalize(None, target_close, exitpriority=10)
+    multiprocessing.util.Finalize(None, dbpool.close, exitpriority=5)
+
+
+def migrate_parallel(phases):
+    """Migrate tables concurrently in a pool of worker processes.
+
+    Arguments
+    ---------
+    phases : list of list
+        Migration jobs split into phases. A phase starts after all jobs of
+        the previous one have finished. Jobs within a phase are started from
+        the largest source table.
+
+    """
+    phases = [schedule(jobs) for jobs in phases]
+    # Workers use their own connections
+    source_close()
+    target_close()
+    dbpool.close()
+    semaphore = None
+    if cmdline.queries:
+        semaphore = multiprocessing.BoundedSemaphore(cmdline.queries)
+    initargs = (cmdline, semaphore)
+    with multiprocessing.Pool(cmdline.jobs, worker_init, initargs) as pool:
+        for jobs in phases:
+            for result in pool.imap_unordered(migrate_job, jobs):
+                record_job(result)
+        pool.close()
+        pool.join()
+
+
 ###############################################################################
 # Setup functions
 ###############################################################################
@@ -283,6 +1372,7 @@ def setup_params():
     Script.fullname = os.path.splitext(os.path.abspath(__file__))[0]
     Script.basename = os.path.basename(__file__)
     Script.name = os.path.splitext(Script.basename)[0]
+    Script.watermarks = Script.fullname + '_watermarks.json'
 
 
 def setup_cmdline():
@@ -325,9 +1415,102 @@ def setup_cmdline():
         action='store_true',
         help='List of migrated codelists and agendas.'
     )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=1,
+        help='Number of tables migrated concurrently.'
+    )
+    parser.add_argument(
+        '-i', '--incremental',
+        action='store_true',
+        help='Migrate only records created or modified since the previous'
+             ' incremental migration of a table.'
+    )
+    parser.add_argument(
+        '-s', '--only-stale',
+        action='store_true',
+        help='Skip tables with the same latest modification datetime'
+             ' and number of records in the source and target.'
+    )
+    parser.add_argument(
+        '-b', '--batch',
+        type=int,
+        default=Batch.size,
+        help='Initial number of records in a multi-row insert, adapted'
+             ' to the server latency, zero for single-row inserts.'
+             ' Default: ' + str(Batch.size)
+    )
+    parser.add_argument(
+        '-t', '--transform',
+        action='store_true',
+        help='Compute derived fields in Python instead of by SQL'
+             ' expressions in the target database.'
+    )
+    parser.add_argument(
+        '--bulk',
+        action='store_true',
+        help='Load records by the server bulk loader from a local file,'
+             ' if the server allows it.'
+    )
+    parser.add_argument(
+        '-p', '--pushdown',
+        action='store_true',
+        help='Copy tables by the database server itself, if the source'
+             ' and target databases are on the same server.'
+    )
+    parser.add_argument(
+        '--sync',
+        action='store_true',
+        help='Copy and delete only records of ranges, which differ in'
+             ' the source and target table according to their checksums.'
+    )
+    parser.add_argument(
+        '--shadow',
+        action='store_true',
+        help='Load a copy of a target table and replace the table with it'
+             ' at once instead of truncating it.'
+    )
+    parser.add_argument(
+        '-k', '--chunk',
+        type=int,
+        default=0,
+        help='Number of records read and written at once (streaming),'
+             ' zero for entire table.'
+    )
+    parser.add_argument(
+        '-r', '--read-ahead',
+        type=int,
+        default=0,
+        help='Number of chunks read concurrently ahead of writing,'
+             ' zero for alternate reading and writing.'
+    )
+    parser.add_argument(
+        '--rate',
+        type=float,
+        help='Maximal number of source records read per second by all jobs,'
+             ' reduced automatically when the source server slows down.'
+             ' Records are charged after each query, so without the option'
+             ' --chunk tables are read in chunks of about one second'
+             ' of reading.'
+    )
+    parser.add_argument(
+        '--queries',
+        type=int,
+        help='Maximal number of concurrent queries to the source database.'
+    )
+    parser.add_argument(
+        '--statement-time',
+        type=float,
+        help='Maximal duration of a source query in seconds.'
+    )
     # Process command line arguments
     global cmdline
     cmdline = parser.parse_args()
+    Batch.size = cmdline.batch or Batch.size
+    # Limited rate requires bounded queries
+    if cmdline.rate and not cmdline.chunk:
+        cmdline.chunk = max(int(cmdline.rate / max(cmdline.jobs, 1)), 1)
 
 
 def setup_logger():
@@ -360,6 +1543,11 @@ def main():
             print('Migrated {}: {}'.format(source, roots))
         return
     logger.info('Migration started')
+    governor.configure(
+        rate=cmdline.rate,
+        queries=cmdline.queries,
+        timeout=cmdline.statement_time,
+        )
     # Connect to source database
     Source.database = db.source_config['database']
     if not source_open():
@@ -368,48 +1556,57 @@ def main():
     Target.database = db.target_config['database']
     if not target_open():
         return
-    # Migrate codelists
+    # Migrate codelists before agendas referencing them
+    phases = []
     if cmdline.codelist is not None:
-        Target.register = sql.compose_table(
+        register = sql.compose_table(
             sql.target_table_prefix_codelist,
             sql.target_table_register_codelist,
         )
-        if cmdline.codelist == Source.ALL:
-            tables = [
-                k for k, v in sql.source.items()
-                if k.startswith(sql.source_table_prefix_codelist)
-                ]
-            for table in tables:
-                Source.table = table
-                migrate()
-        else:
-            for codelist in cmdline.codelist.split(','):
-                Source.table = sql.compose_table(
-                    sql.source_table_prefix_codelist,
-                    codelist,
-                )
-                migrate()
-        Target.register = None
-    # Migrate agendas
+        tables = source_tables(
+            sql.source_table_prefix_codelist,
+            cmdline.codelist,
+        )
+        phases.append([(table, register) for table in tables])
     if cmdline.agenda is not None:
-        if cmdline.agenda == Source.ALL:
-            tables = [
-                k for k, v in sql.source.items()
-                if k.startswith(sql.source_table_prefix_agenda)
-                ]
-            for table in tables:
-                Source.table = table
-                migrate()
-        else:
-            for agenda in cmdline.agenda.split(','):
-                Source.table = sql.compose_table(
-                    sql.source_table_prefix_agenda,
-                    agenda,
-                )
-                migrate()
+        tables = source_tables(
+            sql.source_table_prefix_agenda,
+            cmdline.agenda,
+        )
+        phases.append([(table, None) for table in tables])
+    if cmdline.incremental:
+        Source.watermarks = load_watermarks()
+    if cmdline.pushdown and not colocated():
+        logger.warning(
+            'Databases %s and %s are on different servers,'
+            ' copying records through the client',
+            Source.database,
+            Target.database,
+            )
+        cmdline.pushdown = False
+    if cmdline.pushdown and cmdline.rate:
+        logger.warning(
+            'Copying by the server cannot be limited by rate,'
+            ' copying records through the client'
+            )
+        cmdline.pushdown = False
+    if cmdline.jobs > 1:
+        migrate_parallel(phases)
+    else:
+        for jobs in phases:
+            for job in jobs:
+                record_job(migrate_job(job))
+    if cmdline.incremental:
+        save_watermarks()
+    # Update user in registration table
+    if Target.registered and target_open():
+        update_register()
     # Close all databases
     source_close()
     target_close()
+    for pool, stats in dbpool.statistics().items():
+        logger.debug('Pool %s usage: %s', pool, stats)
+    dbpool.close()
     logger.info('Migration finished')
 
 
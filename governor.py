@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""Module governing load of a production source database.
+
+Notes
+-----
+- Only governed connections are limited. A script governs a connection right
+  after it gets it from a pool, because a pooled connection loses its session
+  settings when it is returned to the pool.
+- Rows read from source tables are limited by a token bucket refilled with
+  the configured rate of rows per second.
+- Concurrent source queries are limited by a semaphore, which can be shared
+  by worker processes.
+- Statement duration is limited by the session variable `max_statement_time`
+  on MariaDB or `max_execution_time` on MySQL.
+- When a repeated query takes substantially longer than before, the governor
+  backs off by pausing after each query and dividing the rate. It recovers
+  gradually, when response time drops again.
+
+"""
+__version__ = '0.1.0'
+__status__ = 'Beta'
+__author__ = 'Libor Gabaj'
+__copyright__ = 'Copyright 2019, ' + __author__
+__credits__ = [__author__]
+__license__ = 'MIT'
+__maintainer__ = __author__
+__email__ = 'libor.gabaj@gmail.com'
+
+# Standard library modules
+import logging
+import threading
+import time
+import weakref
+import mysql.connector as mysql
+
+
+###############################################################################
+# Module global variables
+###############################################################################
+logger = logging.getLogger(__name__)
+
+
+###############################################################################
+# Enumeration and parameter classes
+###############################################################################
+class Governor:
+    """Limits and current state of the governor."""
+
+    (
+        rate, semaphore, timeout, tokens, stamp, factor, baselines,
+        connections, lock,
+    ) = (
+        None, None, None, 0.0, 0.0, 1.0, {},
+        weakref.WeakSet(), threading.Lock(),
+    )
+    (
+        SLOWDOWN, BACKOFF, RECOVERY, FACTOR_MAX, DRIFT,
+    ) = (2.0, 2.0, 0.8, 16.0, 1.1,)
+
+
+class Query:
+    """Context of a governed query.
+
+    Arguments
+    ---------
+    conn : object
+        Connection object the query is executed on.
+    key : str
+        Identification of repeated queries, usually the query string.
+
+    Notes
+    -----
+    - The caller should set the attribute `rows` to the number of records read
+      or examined by the query.
+
+    """
+
+    def __init__(self, conn, key):
+        self.governed = conn in Governor.connections
+        self.key = key
+        self.rows = 0
+        self.start = None
+
+    def __enter__(self):
+        if self.governed:
+            if Governor.semaphore is not None:
+                Governor.semaphore.acquire()
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.governed:
+            return False
+        elapsed = time.perf_counter() - self.start
+        if Governor.semaphore is not None:
+            Governor.semaphore.release()
+        if exc_type is None:
+            pause = adapt(self.key, elapsed)
+            throttle(self.rows)
+            if pause > 0:
+                time.sleep(pause)
+        return False
+
+
+###############################################################################
+# Actions
+###############################################################################
+def configure(rate=None, queries=None, timeout=None, semaphore=None):
+    """Set limits of the governor.
+
+    Arguments
+    ---------
+    rate : float
+        Maximal number of source records read per second, unlimited if None.
+    queries : int
+        Maximal number of concurrent source queries, unlimited if None.
+    timeout : float
+        Maximal duration of a source statement in seconds, unlimited if None.
+    semaphore : object
+        Semaphore limiting concurrent source queries of several processes.
+        It takes precedence over the argument `queries`.
+
+    """
+    with Governor.lock:
+        Governor.rate = rate or None
+        Governor.timeout = timeout or None
+        if semaphore is not None:
+            Governor.semaphore = semaphore
+        elif queries:
+            Governor.semaphore = threading.BoundedSemaphore(queries)
+        else:
+            Governor.semaphore = None
+        Governor.tokens = Governor.rate or 0.0
+        Governor.stamp = time.monotonic()
+        Governor.factor = 1.0
+        Governor.baselines = {}
+
+
+def govern(conn):
+    """Put a connection under the control of the governor.
+
+    Arguments
+    ---------
+    conn : object
+        Connection object to a source database.
+
+    Returns
+    -------
+    conn : object
+        The same connection object for chaining.
+
+    """
+    Governor.connections.add(conn)
+    if Governor.timeout:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                'SET SESSION max_statement_time = %s',
+                (float(Governor.timeout),)
+                )
+        except mysql.Error:
+            try:
+                cursor.execute(
+                    'SET SESSION max_execution_time = %s',
+                    (int(Governor.timeout * 1000),)
+                    )
+            except mysql.Error as err:
+                logger.warning('Statement time not limited: %s', err)
+        finally:
+            cursor.close()
+    return conn
+
+
+def query(conn, key=None):
+    """Create a context of a governed query.
+
+    Arguments
+    ---------
+    conn : object
+        Connection object the query is executed on. Queries on connections,
+        which are not governed, are not limited.
+    key : str
+        Identification of repeated queries for detecting their slowdown.
+
+    Returns
+    -------
+    Query
+        Context manager of the query.
+
+    """
+    return Query(conn, key)
+
+
+def adapt(key, elapsed):
+    """Adapt backoff factor to the response time of a query.
+
+    Arguments
+    ---------
+    key : str
+        Identification of repeated queries.
+    elapsed : float
+        Duration of the query in seconds.
+
+    Returns
+    -------
+    float
+        Pause in seconds before the next query.
+
+    """
+    if key is None:
+        return 0.0
+    with Governor.lock:
+        baseline = Governor.baselines.get(key)
+        if baseline is None:
+            Governor.baselines[key] = elapsed
+            return 0.0
+        if elapsed > Governor.SLOWDOWN * baseline:
+            factor = min(Governor.factor * Governor.BACKOFF,
+                         Governor.FACTOR_MAX)
+            if factor > Governor.factor:
+                logger.debug(
+                    'Source response %.3fs over %.3fs, backing off %.1fx',
+                    elapsed, baseline, factor
+                    )
+        else:
+            factor = max(Governor.factor * Governor.RECOVERY, 1.0)
+        Governor.factor = factor
+        Governor.baselines[key] = min(elapsed, baseline * Governor.DRIFT)
+        return elapsed * (factor - 1.0)
+
+
+def throttle(rows):
+    """Wait until reading of records is allowed by the rate limit.
+
+    Arguments
+    ---------
+    rows : int
+        Number of records read or examined by a query.
+
+    """
+    with Governor.lock:
+        if not Governor.rate:
+            return
+        rate = Governor.rate / Governor.factor
+        now = time.monotonic()
+        Governor.tokens = min(
+            Governor.tokens + (now - Governor.stamp) * rate,
+            Governor.rate
+            )
+        Governor.stamp = now
+        Governor.tokens -= rows
+        wait = -Governor.tokens / rate if Governor.tokens < 0 else 0.0
+    if wait > 0:
+        time.sleep(wait)
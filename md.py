@@ -6,8 +6,12 @@ Notes
 - For each source and target table the latest modification datime is displayed.
 - If some source table has latest modification datetime younger than the target
   one, it is flagged.
+- In checksum mode ranges of primary keys with different content of source
+  and target table are listed.
+- In estimate mode table pairs looking up to date according to the information
+  schema are not probed and they are flagged with '~' and estimated values.
 """
-__version__ = '0.3.0'
+__version__ = '0.4.0'
 __status__ = 'Beta'
 __author__ = 'Libor Gabaj'
 __copyright__ = 'Copyright 2019, ' + __author__
@@ -22,9 +26,12 @@ import argparse
 import logging
 import mysql.connector as mysql
 import datetime
+import concurrent.futures
 
 # Third party modules
 import dbconfig as db
+import dbpool
+import governor
 import sql
 
 
@@ -65,39 +72,6 @@ class Target:
 ###############################################################################
 # Actions
 ###############################################################################
-def connect_db(config):
-    """Connect to a database.
-
-    Arguments
-    ---------
-    config : dict
-        Connection configuration to a database.
-
-    Returns
-    -------
-    connection : object
-        Connection object to a database.
-
-    Raises
-    -------
-    mysql.connector.Error
-        Native exception of the database connector.
-
-    """
-    try:
-        conn = mysql.connect(**config)
-        logger.debug('Database %s connected', config['database'])
-        return conn
-    except mysql.Error as err:
-        if err.errno == mysql.errorcode.ER_ACCESS_DENIED_ERROR:
-            logger.error('Bad database %s credentials', config['database'])
-        elif err.errno == mysql.errorcode.ER_BAD_DB_ERROR:
-            logger.error('Database %s does not exist', config['database'])
-        else:
-            logger.error(err)
-        raise
-
-
 def source_open():
     """Connect to a source database.
 
@@ -109,7 +83,8 @@ def source_open():
     """
     if Source.conn is None:
         try:
-            Source.conn = connect_db(db.source_config)
+            Source.conn = governor.govern(
+                dbpool.connect('source', size=cmdline.jobs + 1))
         except Exception:
             logger.error(
                 'Cannot connect to the source database %s',
@@ -144,7 +119,7 @@ def target_open():
     """
     if Target.conn is None:
         try:
-            Target.conn = connect_db(db.target_config)
+            Target.conn = dbpool.connect('target', size=cmdline.jobs + 1)
         except Exception:
             logger.error(
                 'Cannot connect to the target database %s',
@@ -162,6 +137,7 @@ def target_close():
     # Close connection to database
     if Target.conn is not None:
         Target.conn.close()
+    dbpool.close()
 
 
 ###############################################################################
@@ -203,6 +179,57 @@ def setup_cmdline():
         action='store_true',
         help='Show agenda tables.'
     )
+    parser.add_argument(
+        '-e', '--estimate',
+        action='store_true',
+        help='Probe exactly only tables looking stale according to'
+             ' the information schema.'
+    )
+    parser.add_argument(
+        '--ensure-indexes',
+        action='store_true',
+        help='Create missing indexes on modification and creation datetimes'
+             ' of shown tables before probing them. Latest datetimes are'
+             ' then read from indexes, but exact numbers of records of'
+             ' InnoDB tables still need an index scan, see --estimate.'
+    )
+    parser.add_argument(
+        '--checksum',
+        action='store_true',
+        help='Compare source and target tables by checksums of ranges'
+             ' of records and show differing ranges.'
+    )
+    parser.add_argument(
+        '--range',
+        type=int,
+        default=1000,
+        help='Number of primary keys in a checksum range, default: 1000.'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=1,
+        help='Number of tables probed concurrently in a database,'
+             ' if they cannot be probed at once.'
+    )
+    parser.add_argument(
+        '--rate',
+        type=float,
+        help='Maximal number of source records examined per second,'
+             ' reduced automatically when the source server slows down.'
+             ' Records are charged after each query, so a single probe or'
+             ' checksum of a table is not slowed down itself.'
+    )
+    parser.add_argument(
+        '--queries',
+        type=int,
+        help='Maximal number of concurrent queries to the source database.'
+    )
+    parser.add_argument(
+        '--statement-time',
+        type=float,
+        help='Maximal duration of a source query in seconds.'
+    )
     # Process command line arguments
     global cmdline
     cmdline = parser.parse_args()
@@ -218,13 +245,349 @@ def setup_logger():
     logger = logging.getLogger(Script.name)
 
 
-def tablelist(table_prefix):
+def parse_timestamp(timestamp):
+    """Convert a datetime returned by a database as a string."""
+    format_db = '%Y-%m-%d %H:%M:%S'
+    if isinstance(timestamp, (bytes, bytearray)):
+        timestamp = timestamp.decode()
+    if isinstance(timestamp, str):
+        timestamp = datetime.datetime.strptime(timestamp, format_db)
+    return timestamp
+
+
+def probe(conn, table):
+    """Determine latest modification datetime and number of records.
+
+    Arguments
+    ---------
+    conn : object
+        Connection object to a database with the table.
+    table : str
+        Real table name.
+
+    Returns
+    -------
+    tuple
+        Latest modification datetime or None and number of records.
+
+    Raises
+    -------
+    mysql.connector.Error
+        Native exception of the database connector.
+
+    """
+    return probe_tables(conn, [table])[table]
+
+
+def probe_tables(conn, tables):
+    """Determine latest modification datetimes and numbers of records
+    of tables by a single query.
+
+    Arguments
+    ---------
+    conn : object
+        Connection object to a database with the tables.
+    tables : list of str
+        Real table names.
+
+    Returns
+    -------
+    dict
+        Pairs of latest modification datetime or None and number of records
+        keyed by table names.
+
+    Raises
+    -------
+    mysql.connector.Error
+        Native exception of the database connector. The query fails, if any
+        of tables does not exist.
+
+    """
+    query = sql.compose_union(tables, sql.probe_fields)
+    cursor = conn.cursor()
+    try:
+        with governor.query(conn) as governed:
+            cursor.execute(query)
+            records = cursor.fetchall()
+            governed.rows = sum([r[2] or 0 for r in records])
+    finally:
+        cursor.close()
+    return {
+        tables[index]: (parse_timestamp(timestamp), count)
+        for index, timestamp, count in records
+    }
+
+
+def both_sides(func, source_args, target_args):
+    """Call a function for the source and target database concurrently.
+
+    Arguments
+    ---------
+    func : callable
+        Function called in a separate thread for each database.
+    source_args : tuple
+        Positional arguments of the call for the source database.
+    target_args : tuple
+        Positional arguments of the call for the target database.
+
+    Returns
+    -------
+    tuple
+        Results of the calls for the source and the target database.
+
+    Raises
+    -------
+    Exception
+        Exception raised by any of the calls.
+
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        source_future = executor.submit(func, *source_args)
+        target_future = executor.submit(func, *target_args)
+        return source_future.result(), target_future.result()
+
+
+def probe_side(name, conn, tables):
+    """Probe tables of a source or target database.
+
+    Arguments
+    ---------
+    name : str
+        Name of a database configuration, either 'source' or 'target'.
+    conn : object
+        Connection object to the database.
+    tables : list of str
+        Real table names.
+
+    Returns
+    -------
+    dict
+        Pairs of latest modification datetime or None and number of records
+        keyed by table names. Tables, which cannot be probed, are omitted.
+
+    Notes
+    -----
+    - All tables are probed by a single query. If it fails, the tables are
+      probed separately and concurrently, each on its own pooled connection.
+
+    """
+    try:
+        return probe_tables(conn, tables)
+    except mysql.Error as err:
+        logger.debug('%s, probing tables one by one', err)
+
+    def probe_table(table):
+        try:
+            table_conn = dbpool.connect(name)
+        except mysql.Error:
+            return None
+        if name == 'source':
+            governor.govern(table_conn)
+        try:
+            return probe(table_conn, table)
+        except mysql.Error as err:
+            logger.error(err)
+        finally:
+            table_conn.close()
+
+    with concurrent.futures.ThreadPoolExecutor(cmdline.jobs) as executor:
+        results = executor.map(probe_table, tables)
+    return {
+        table: result
+        for table, result in zip(tables, results)
+        if result is not None
+    }
+
+
+def ensure_indexes(conn, tables):
+    """Create missing indexes for probing modification datetimes.
+
+    Arguments
+    ---------
+    conn : object
+        Connection object to a database with the tables.
+    tables : list of str
+        Real table names.
+
+    Returns
+    -------
+    int
+        Number of created indexes.
+
+    """
+    fields = sql.probe_index_fields
+    query = sql.compose_indexlist(tables, fields)
+    cursor = conn.cursor()
+    created = 0
+    try:
+        cursor.execute(query)
+        indexed = set()
+        for table, field in cursor.fetchall():
+            if isinstance(table, (bytes, bytearray)):
+                table = table.decode()
+            if isinstance(field, (bytes, bytearray)):
+                field = field.decode()
+            indexed.add((table, field))
+        for table in tables:
+            for field in fields:
+                if (table, field) in indexed:
+                    continue
+                try:
+                    cursor.execute(sql.compose_create_index(table, field))
+                    created += 1
+                    logger.info('Index on %s.%s created', table, field)
+                except mysql.Error as err:
+                    logger.error(err)
+    except mysql.Error as err:
+        logger.error(err)
+    finally:
+        cursor.close()
+    return created
+
+
+def freshness(table):
+    """Compare modification datetimes of a source and target table.
+
+    Arguments
+    ---------
+    table : dict
+        Source-target record from :func:`tablelist`.
+
+    Returns
+    -------
+    str
+        Flag '???' for unknown datetime, '!!!' for younger source, '<' for
+        older source, and '=' for equal datetimes.
+
+    """
+    if table['source_timestamp'] is None \
+    or table['target_timestamp'] is None:
+        return '???'
+    elif table['source_timestamp'] > table['target_timestamp']:
+        return '!!!'
+    elif table['source_timestamp'] < table['target_timestamp']:
+        return '<'
+    elif table['source_timestamp'] == table['target_timestamp']:
+        return '='
+    return ''
+
+
+def is_stale(table):
+    """Check whether a target table is not up to date with a source table.
+
+    Arguments
+    ---------
+    table : dict
+        Source-target record from :func:`tablelist`.
+
+    Returns
+    -------
+    bool
+        Flag about different modification datetimes or number of records.
+
+    """
+    return not (
+        freshness(table) == '='
+        and table['source_count'] == table['target_count']
+    )
+
+
+def estimate_side(conn, tables):
+    """Read statistics of tables from the information schema.
+
+    Arguments
+    ---------
+    conn : object
+        Connection object to a database with the tables.
+    tables : list of str
+        Real table names.
+
+    Returns
+    -------
+    dict
+        Tuples of update datetime or None, estimated number of records, and
+        storage engine keyed by table names. Missing tables are omitted.
+
+    """
+    query = sql.compose_tablerows(tables, 'UPDATE_TIME, TABLE_ROWS, ENGINE')
+    cursor = conn.cursor()
+    try:
+        with governor.query(conn):
+            cursor.execute(query)
+            records = cursor.fetchall()
+    except mysql.Error as err:
+        logger.error(err)
+        return {}
+    finally:
+        cursor.close()
+    stats = {}
+    for name, timestamp, count, engine in records:
+        if isinstance(name, (bytes, bytearray)):
+            name = name.decode()
+        if isinstance(engine, (bytes, bytearray)):
+            engine = engine.decode()
+        stats[name] = (parse_timestamp(timestamp), count, engine)
+    return stats
+
+
+def estimate_tables(tables):
+    """Mark source-target records, which look up to date.
+
+    Arguments
+    ---------
+    tables : list of dict
+        Source-target records from :func:`tablelist`, which are updated
+        in place by estimated datetimes and numbers of records.
+
+    Returns
+    -------
+    list of dict
+        Updated source-target records. Records flagged as estimated look up
+        to date and need not be probed exactly.
+
+    Notes
+    -----
+    - Both tables of a pair are read by one query per database server.
+    - A pair is a candidate for exact probing, if an update datetime is
+      unknown, the source one is younger than the target one, or the numbers
+      of records differ for storage engines with exact numbers.
+
+    """
+    exact_engines = ('MyISAM', 'Aria')
+    source_stats, target_stats = both_sides(
+        estimate_side,
+        (Source.conn, [table['source_table'] for table in tables]),
+        (Target.conn, [table['target_table'] for table in tables]),
+    )
+    for table in tables:
+        table['estimated'] = False
+        source = source_stats.get(table['source_table'])
+        target = target_stats.get(table['target_table'])
+        if source is None or target is None:
+            continue
+        if source[0] is None or target[0] is None or source[0] > target[0]:
+            continue
+        if source[2] in exact_engines and target[2] in exact_engines \
+        and source[1] != target[1]:
+            continue
+        table['estimated'] = True
+        table['source_count'] = f'~{source[1]}'
+        table['target_count'] = f'~{target[1]}'
+        table['source_datetime'] = f'~{source[0]:%d.%m.%Y %H:%M:%S}'
+        table['target_datetime'] = f'~{target[0]:%d.%m.%Y %H:%M:%S}'
+    return tables
+
+
+def tablelist(table_prefix, estimate=False):
     """List of source and target tables with modification datetimes.
 
     Arguments
     ---------
     table_prefix : str
         Prefix of tables.
+    estimate : bool
+        Flag about probing exactly only tables, which look stale according
+        to the information schema.
 
     Returns
     -------
@@ -234,7 +597,6 @@ def tablelist(table_prefix):
 
     """
     format = '%d.%m.%Y %H:%M:%S'
-    format_db = '%Y-%m-%d %H:%M:%S'
     tables = [{
                 'source_table': source_table,
                 'source_datetime': None,
@@ -249,61 +611,131 @@ def tablelist(table_prefix):
               in sql.source.items()
               if source_table.startswith(table_prefix)
               ]
-    for i, table in enumerate(tables):
-        # Source datetime
-        Source.query = sql.compose_select(
-            table['source_table'],
-            'MAX(GREATEST(modified, created)), COUNT(*)'
-        )
-        Source.cursor = Source.conn.cursor()
-        try:
-            Source.cursor.execute(Source.query)
-            record = Source.cursor.fetchone()
-            timestamp = record[0]
-            if isinstance(timestamp, str):
-                timestamp = datetime.datetime.strptime(timestamp, format_db)
-            tables[i]['source_timestamp'] = timestamp
-            tables[i]['source_count'] = record[1]
+    candidates = tables
+    if estimate:
+        candidates = [table for table in estimate_tables(tables)
+                      if not table['estimated']]
+    # All tables look up to date
+    if not candidates:
+        return tables
+    results = both_sides(
+        probe_side,
+        ('source', Source.conn, [t['source_table'] for t in candidates]),
+        ('target', Target.conn, [t['target_table'] for t in candidates]),
+    )
+    for side, probes in zip(('source', 'target'), results):
+        for table in candidates:
+            if table[f'{side}_table'] not in probes:
+                continue
+            timestamp, count = probes[table[f'{side}_table']]
+            table[f'{side}_timestamp'] = timestamp
+            table[f'{side}_count'] = count
             try:
-                tables[i]['source_datetime'] = timestamp.strftime(format)
-            except AttributeError as err:
-                tables[i]['source_datetime'] = 'N/A'
-                # errmsg = \
-                #     f"{table['source_table']}" \
-                #     f".modified" \
-                #     f" - {err}"
-                # logger.error(errmsg)
-        except mysql.Error as err:
-            logger.error(err)
-        finally:
-            Source.cursor.close()
-        # Target datetime
-        Target.query = sql.compose_select(
-            table['target_table'],
-            'MAX(GREATEST(modified, created)), COUNT(*)'
-        )
-        Target.cursor = Target.conn.cursor()
+                table[f'{side}_datetime'] = timestamp.strftime(format)
+            except AttributeError:
+                table[f'{side}_datetime'] = 'N/A'
+    return tables
+
+
+def checksum_side(conn, table, fields, size, where=None, params=None):
+    """Compute checksums of ranges of primary keys of a table.
+
+    Arguments
+    ---------
+    conn : object
+        Connection object to a database with the table.
+    table : str
+        Real table name.
+    fields : list of str
+        Expressions over table fields included in checksums.
+    size : int
+        Number of primary keys in a range.
+    where : str
+        Optional condition restricting checked records.
+    params : dict
+        Parameters of the condition.
+
+    Returns
+    -------
+    dict
+        Pairs of number of records and checksum keyed by range numbers.
+
+    Raises
+    -------
+    mysql.connector.Error
+        Native exception of the database connector.
+
+    """
+    query = sql.compose_checksum(table, fields, size, where)
+    cursor = conn.cursor()
+    try:
+        with governor.query(conn, query) as governed:
+            cursor.execute(query, params)
+            records = cursor.fetchall()
+            governed.rows = sum([r[1] for r in records])
+    finally:
+        cursor.close()
+    return {
+        int(range_id): (int(count), int(checksum))
+        for range_id, count, checksum in records
+    }
+
+
+def checksum_list(table_prefix):
+    """List of source and target tables with differing ranges of records.
+
+    Arguments
+    ---------
+    table_prefix : str
+        Prefix of tables.
+
+    Returns
+    -------
+    list : dict
+        List of source-target records with list of differing ranges as tuples
+        with the first and last primary key and numbers of source and target
+        records in a range. The list is None, if checksums cannot be computed.
+
+    Notes
+    -----
+    - Checksums are computed by database servers over all mapped fields,
+      source ones by the same expressions as at migration. No record is
+      transferred to the client.
+
+    """
+    size = cmdline.range
+    tables = []
+    for source_table, target in sql.source.items():
+        if not source_table.startswith(table_prefix):
+            continue
+        table = {
+            'source_table': source_table,
+            'target_table': target['table_target'],
+            'ranges': None,
+        }
+        tables.append(table)
+        mapping = sql.compose_mapping(source_table)
         try:
-            Target.cursor.execute(Target.query)
-            record = Target.cursor.fetchone()
-            timestamp = record[0]
-            if isinstance(timestamp, str):
-                timestamp = datetime.datetime.strptime(timestamp, format_db)
-            tables[i]['target_timestamp'] = timestamp
-            tables[i]['target_count'] = record[1]
-            try:
-                tables[i]['target_datetime'] = timestamp.strftime(format)
-            except AttributeError as err:
-                tables[i]['target_datetime'] = 'N/A'
-                # errmsg = \
-                #     f"{table['target_table']}" \
-                #     f".modified" \
-                #     f" - {err}"
-                # logger.error(errmsg)
+            source_sums, target_sums = both_sides(
+                checksum_side,
+                (Source.conn, table['source_table'],
+                 [m[1] for m in mapping], size),
+                (Target.conn, table['target_table'],
+                 [m[0] for m in mapping], size),
+            )
         except mysql.Error as err:
             logger.error(err)
-        finally:
-            Target.cursor.close()
+            continue
+        table['ranges'] = [
+            (
+                range_id * size,
+                (range_id + 1) * size - 1,
+                source_sums.get(range_id, (0,))[0],
+                target_sums.get(range_id, (0,))[0],
+            )
+            for range_id in sorted(set(source_sums) | set(target_sums))
+            if source_sums.get(range_id) != target_sums.get(range_id)
+        ]
     return tables
 
 
@@ -316,6 +748,11 @@ def main():
     setup_cmdline()
     setup_logger()
     if cmdline.codelists or cmdline.agendas:
+        governor.configure(
+            rate=cmdline.rate,
+            queries=cmdline.queries,
+            timeout=cmdline.statement_time,
+            )
         # Connect to source database
         Source.database = db.source_config['database']
         if not source_open():
@@ -329,28 +766,48 @@ def main():
             'codelists': sql.source_table_prefix_codelist,
             'agendas': sql.source_table_prefix_agenda,
         }
+        colors = {
+            '???': esc(96),  # Cyan
+            '!!!': esc(31),  # Red
+            '<': esc(93),  # Yellow
+        }
         for source, prefix in sources.items():
             if not eval(f'cmdline.{source}'):
                 continue
-            tables = tablelist(prefix)
+            if cmdline.ensure_indexes:
+                pairs = {
+                    k: v['table_target'] for k, v in sql.source.items()
+                    if k.startswith(prefix)
+                }
+                ensure_indexes(Source.conn, list(pairs.keys()))
+                ensure_indexes(Target.conn, list(pairs.values()))
             print()
             print(f'{source.capitalize()}:')
+            if cmdline.checksum:
+                for table in checksum_list(prefix):
+                    ranges = table['ranges']
+                    if ranges is None:
+                        prefix = '???'
+                    elif ranges:
+                        prefix = '!!!'
+                    else:
+                        prefix = '='
+                    msg = \
+                        f"{prefix.ljust(4)}" \
+                        f"{table['source_table']} -> " \
+                        f"{table['target_table']}"
+                    print(colors.get(prefix, esc(0)) + msg)
+                    for first, last, source_count, target_count \
+                    in ranges or []:
+                        print(
+                            f"    id {first}-{last} "
+                            f"({source_count} -> {target_count})"
+                        )
+                continue
+            tables = tablelist(prefix, cmdline.estimate)
             for table in tables:
-                ansi = esc(0)
-                if table['source_timestamp'] is None \
-                or table['target_timestamp'] is None:
-                    prefix = '???'
-                    ansi = esc(96)  # Cyan
-                elif table['source_timestamp'] > table['target_timestamp']:
-                    prefix = '!!!'
-                    ansi = esc(31)  # Red
-                elif table['source_timestamp'] < table['target_timestamp']:
-                    prefix = '<'
-                    ansi = esc(93)  # Yellow
-                elif table['source_timestamp'] == table['target_timestamp']:
-                    prefix = '='
-                else:
-                    prefix = ''
+                prefix = '~' if table.get('estimated') else freshness(table)
+                ansi = colors.get(prefix, esc(0))
                 msg = \
                     f"{prefix.ljust(4)}" \
                     f"{table['source_table']} (" \
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 """Module with SQL DML strings for MariaDB databases."""
-__version__ = '0.4.1'
+__version__ = '0.5.0'
 __status__ = 'Beta'
 __author__ = 'Libor Gabaj'
 __copyright__ = 'Copyright 2019, ' + __author__
@@ -9,11 +9,22 @@ __license__ = 'MIT'
 __maintainer__ = __author__
 __email__ = 'libor.gabaj@gmail.com'
 
+# Standard library modules
+import re
+
 
 ###############################################################################
 # Source database
 ###############################################################################
 source_table_prefix_agenda = 'jos_familylist_'
+source_table_key = 'id'
+# Latest change of a record, modification datetime can be NULL
+source_table_watermark = 'GREATEST(IFNULL(modified, created), created)'
+source_table_range = \
+    f'{source_table_key} BETWEEN %(range_first)s AND %(range_last)s'
+source_table_watermark_newer = \
+    f'({source_table_watermark} > %(mark_timestamp)s' \
+    f' OR {source_table_key} > %(mark_id)s)'
 source_table_prefix_codelist = 'jos_codelist_'
 source_table_fields_codelist = (
     'id, created, modified, published AS state'
@@ -142,6 +153,8 @@ source = {
 target_table_prefix_agenda = 'lgbj_gbjfamily_'
 target_table_prefix_codelist = 'lgbj_gbjcodes_'
 target_table_register_codelist = 'codebooks'
+target_table_suffix_shadow = '__new'
+target_table_suffix_old = '__old'
 target_table_fields_codelist = (
     'params, metakey, metadesc, metadata'
     ', id, created, modified, state, description, title, alias'
@@ -163,7 +176,30 @@ target_table_values_agenda = (
     ', IFNULL(%(modified)s, %(created)s)'
     ', %(date_on)s'
     )
+placeholder = r'%\((\w+)\)s'
+# Each maximum can be read from an index, modification datetime can be NULL.
+# The exact number of records is read from table metadata only for MyISAM
+# and Aria tables, InnoDB tables are scanned by the smallest index for it.
+probe_fields = (
+    'GREATEST(COALESCE(MAX(modified), MAX(created))'
+    ', COALESCE(MAX(created), MAX(modified))), COUNT(*)'
+    )
+probe_index_fields = ('modified', 'created')
+tsv_escapes = str.maketrans({
+    '\\': '\\\\',
+    '\t': '\\t',
+    '\n': '\\n',
+    '\r': '\\r',
+    '\0': '\\0',
+    })
+target_table_transforms_agenda = {
+    'modified': ('ifnull', 'modified', 'created'),
+}
+target_users_fields = 'created_by, modified_by'
+target_users_values = '{user:d}, {user:d}'
 target_users = 'created_by = %(user)s, modified_by = %(user)s'
+target_users_differ = \
+    'NOT (created_by <=> %(user)s AND modified_by <=> %(user)s)'
 target = {
     'lgbj_gbjcodes_activities': {
         'fields': target_table_fields_codelist,
@@ -216,6 +252,10 @@ target = {
             ', IF(%(price_orig)s, %(price_orig)s, NULL)'
             ', %(id_domain)s, %(id_currency)s, %(id_asset)s'
         ),
+        'transforms': {
+            **target_table_transforms_agenda,
+            'price_orig': ('iftrue', 'price_orig'),
+        },
     },
     'lgbj_gbjfamily_events': {
         'fields': target_table_fields_agenda + (
@@ -226,6 +266,7 @@ target = {
             ', %(title)s'
             ', %(id_domain)s, %(id_activity)s'
         ),
+        'transforms': target_table_transforms_agenda,
     },
     'lgbj_gbjfamily_expenses': {
         'fields': target_table_fields_agenda + (
@@ -243,6 +284,11 @@ target = {
             ', %(id_domain)s, %(id_currency)s, %(id_commodity)s'
             ', %(id_type)s, %(id_unit)s'
         ),
+        'transforms': {
+            **target_table_transforms_agenda,
+            'price_unit': ('unit_price', 'price', 'quantity'),
+            'price_orig': ('iftrue', 'price_orig'),
+        },
     },
     'lgbj_gbjfamily_fuels': {
         'fields': target_table_fields_agenda + (
@@ -255,6 +301,7 @@ target = {
             ', %(distance)s, %(consumption)s'
             ', %(id_domain)s'
         ),
+        'transforms': target_table_transforms_agenda,
     },
     'lgbj_gbjfamily_incomes': {
         'fields': target_table_fields_agenda + (
@@ -267,6 +314,10 @@ target = {
             ', IF(%(price_orig)s, %(price_orig)s, NULL)'
             ', %(id_domain)s, %(id_currency)s, %(id_asset)s'
         ),
+        'transforms': {
+            **target_table_transforms_agenda,
+            'price_orig': ('iftrue', 'price_orig'),
+        },
     },
     'lgbj_gbjfamily_vacations': {
         'fields': target_table_fields_agenda + (
@@ -279,6 +330,10 @@ target = {
             ', datediff(%(date_off)s, %(date_on)s) + 1'
             ', %(id_stay)s, %(id_staff)s'
         ),
+        'transforms': {
+            **target_table_transforms_agenda,
+            'period': ('period', 'date_on', 'date_off'),
+        },
     },
 }
 
@@ -303,7 +358,7 @@ def compose_table(table_prefix, table_root):
     return table_name
 
 
-def compose_select(table, fields):
+def compose_select(table, fields, where=None, order=None, limit=None):
     """Compose select query string.
 
     Arguments
@@ -312,6 +367,12 @@ def compose_select(table, fields):
         Real table name.
     fields : str
         List of table fields.
+    where : str
+        Optional condition of the query.
+    order : str
+        Optional list of fields for sorting.
+    limit : int
+        Optional maximal number of returned records.
 
     Returns
     -------
@@ -320,10 +381,17 @@ def compose_select(table, fields):
         for query parameters.
 
     """
-    return f'SELECT {fields} FROM {table}'
+    query = f'SELECT {fields} FROM {table}'
+    if where:
+        query += f' WHERE {where}'
+    if order:
+        query += f' ORDER BY {order}'
+    if limit:
+        query += f' LIMIT {limit:d}'
+    return query
 
 
-def compose_insert(table, fields, values):
+def compose_insert(table, fields, values, rows=1):
     """Compose insert command string.
 
     Arguments
@@ -334,6 +402,34 @@ def compose_insert(table, fields, values):
         List of table fields.
     values : dict
         Dictionary of table fields and their values.
+    rows : int
+        Number of inserted rows with the same values template.
+
+    Returns
+    -------
+    str
+        Query string with real table name. However, it can contain placeholders
+        for query parameters.
+
+    """
+    values = ', '.join(['({})'.format(values)] * rows)
+    query = 'INSERT INTO {} ({}) VALUES {}'.format(table, fields, values)
+    return query
+
+
+def compose_upsert(table, fields, values, rows=1):
+    """Compose insert command string updating already existing records.
+
+    Arguments
+    ---------
+    table : str
+        Real table name.
+    fields : str
+        List of table fields.
+    values : dict
+        Dictionary of table fields and their values.
+    rows : int
+        Number of inserted rows with the same values template.
 
     Returns
     -------
@@ -341,12 +437,348 @@ def compose_insert(table, fields, values):
         Query string with real table name. However, it can contain placeholders
         for query parameters.
 
+    Notes
+    -----
+    - All fields except the primary key are updated by values of the insert
+      part of the command for existing records.
+
+    """
+    query = compose_insert(table, fields, values, rows) \
+        + compose_duplicates(fields)
+    return query
+
+
+def compose_duplicates(fields):
+    """Compose clause of an insert command for already existing records.
+
+    Arguments
+    ---------
+    fields : str
+        List of inserted table fields.
+
+    Returns
+    -------
+    str
+        Clause updating all fields except the primary key by inserted values.
+
+    """
+    updates = ', '.join([
+        '{0} = VALUES({0})'.format(field.strip())
+        for field in fields.split(',')
+        if field.strip() != source_table_key
+        ])
+    return ' ON DUPLICATE KEY UPDATE {}'.format(updates)
+
+
+def compose_qualified(database, table):
+    """Compose table name qualified by its database.
+
+    Arguments
+    ---------
+    database : str
+        Database name.
+    table : str
+        Real table name.
+
+    Returns
+    -------
+    str
+        Quoted table name usable across databases of the same server.
+
+    """
+    return '`{}`.`{}`'.format(database, table)
+
+
+def compose_pushdown(table, fields, values, source, source_fields,
+                     where=None, upsert=False):
+    """Compose insert command copying a table within a database server.
+
+    Arguments
+    ---------
+    table : str
+        Qualified target table name.
+    fields : str
+        List of target table fields.
+    values : dict
+        Dictionary of target table fields and their values.
+    source : str
+        Qualified source table name.
+    source_fields : str
+        List of source table fields with aliases used in values placeholders.
+    where : str
+        Optional condition restricting copied source records.
+    upsert : bool
+        Flag about updating already existing records instead of failing.
+
+    Returns
+    -------
+    str
+        Command string evaluating the values template on source records
+        by the server itself. It can contain placeholders for parameters
+        of the condition.
+
+    """
+    values = re.sub(placeholder, r's.\1', values)
+    query = 'INSERT INTO {} ({}) SELECT {} FROM ({}) AS s'.format(
+        table,
+        fields,
+        values,
+        compose_select(source, source_fields, where=where),
+        )
+    if upsert:
+        query += compose_duplicates(fields)
+    return query
+
+
+def compose_placeholders(values):
+    """Convert named placeholders of a values template to positional ones.
+
+    Arguments
+    ---------
+    values : str
+        Values template with named placeholders.
+
+    Returns
+    -------
+    tuple
+        Values template with positional placeholders and list of names of
+        replaced placeholders in order of their occurrence.
+
+    """
+    keys = re.findall(placeholder, values)
+    return re.sub(placeholder, '%s', values), keys
+
+
+def compose_columns(values):
+    """List names of placeholders of a values template without repetitions.
+
+    Arguments
+    ---------
+    values : str
+        Values template with named placeholders.
+
+    Returns
+    -------
+    list of str
+        Names of placeholders in order of their first occurrence.
+
+    """
+    return list(dict.fromkeys(re.findall(placeholder, values)))
+
+
+def split_list(text):
+    """Split comma separated list of fields or values.
+
+    Arguments
+    ---------
+    text : str
+        Comma separated list. Commas within parentheses or quotes do not
+        separate items.
+
+    Returns
+    -------
+    list of str
+        Stripped items of the list.
+
     """
-    query = 'INSERT INTO {} ({}) VALUES ({})'.format(table, fields, values)
+    items = []
+    item = ''
+    depth = 0
+    quote = None
+    for char in text:
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            items.append(item.strip())
+            item = ''
+            continue
+        item += char
+    items.append(item.strip())
+    return items
+
+
+def compose_load(table, fields, values, file, replace=False):
+    """Compose bulk load command string from a local tab separated file.
+
+    Arguments
+    ---------
+    table : str
+        Real table name.
+    fields : str
+        List of table fields.
+    values : dict
+        Dictionary of table fields and their values.
+    file : str
+        Path to a local file with a column for each placeholder of the values
+        template in order of their first occurrence.
+    replace : bool
+        Flag about replacing existing records with the same primary key.
+
+    Returns
+    -------
+    str
+        Command string with real table name. File columns are loaded to user
+        variables and values template expressions are evaluated on them.
+
+    """
+    columns = ', '.join(['@' + key for key in compose_columns(values)])
+    sets = ', '.join([
+        '{} = {}'.format(field, re.sub(placeholder, r'@\1', value))
+        for field, value in zip(split_list(fields), split_list(values))
+        ])
+    query = "LOAD DATA LOCAL INFILE '{}' {}INTO TABLE {}" \
+        " CHARACTER SET utf8mb4 ({}) SET {}".format(
+            file.replace('\\', '/'),
+            'REPLACE ' if replace else '',
+            table,
+            columns,
+            sets,
+            )
     return query
 
 
-def compose_update(table, fields):
+def escape_tsv(value):
+    """Format a value for a tab separated file of a bulk load.
+
+    Arguments
+    ---------
+    value : any
+        Value of a record field.
+
+    Returns
+    -------
+    str
+        Value with escaped special characters or NULL marker.
+
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        value = int(value)
+    elif isinstance(value, (bytes, bytearray)):
+        value = value.decode('utf-8')
+    return str(value).translate(tsv_escapes)
+
+
+def compose_values_plain(fields, values, transforms):
+    """Compose values template with plain placeholders for derived fields.
+
+    Arguments
+    ---------
+    fields : str
+        List of table fields.
+    values : dict
+        Dictionary of table fields and their values.
+    transforms : dict
+        Declarations of fields derived in Python before inserting.
+
+    Returns
+    -------
+    str
+        Values template, in which expressions of derived fields are replaced
+        with placeholders for their computed values.
+
+    """
+    return ', '.join([
+        '%({})s'.format(field) if field in transforms else value
+        for field, value in zip(split_list(fields), split_list(values))
+        ])
+
+
+def compose_aliases(fields):
+    """Map aliases of a select fields list to their expressions.
+
+    Arguments
+    ---------
+    fields : str
+        List of table fields optionally with aliases.
+
+    Returns
+    -------
+    dict
+        Field expressions keyed by their aliases or field names.
+
+    """
+    aliases = {}
+    for field in split_list(fields):
+        parts = re.split(r'\s+AS\s+', field, flags=re.I)
+        aliases[parts[-1]] = parts[0]
+    return aliases
+
+
+def compose_mapping(table):
+    """Map target table fields to expressions over a source table.
+
+    Arguments
+    ---------
+    table : str
+        Real source table name.
+
+    Returns
+    -------
+    list of tuple
+        Pairs of a target field and an expression computing its value from
+        source table fields. Fields with constant values are omitted.
+
+    """
+    aliases = compose_aliases(source[table]['fields'])
+    target_table = source[table]['table_target']
+    mapping = []
+    for field, value in zip(
+            split_list(target[target_table]['fields']),
+            split_list(target[target_table]['values'])):
+        if not re.search(placeholder, value):
+            continue
+        expression = re.sub(placeholder, lambda m: aliases[m.group(1)], value)
+        mapping.append((field, expression))
+    return mapping
+
+
+def compose_checksum(table, fields, size, where=None):
+    """Compose query for checksums of ranges of primary keys.
+
+    Arguments
+    ---------
+    table : str
+        Real table name.
+    fields : list of str
+        Expressions over table fields included in checksums.
+    size : int
+        Number of primary keys in a range.
+    where : str
+        Optional condition restricting checked records.
+
+    Returns
+    -------
+    str
+        Query string returning number of a range, number of its records, and
+        aggregated checksum of its records. Values are converted to the same
+        character set, so that checksums of different databases are
+        comparable.
+
+    """
+    columns = ', '.join([
+        "IFNULL(CONVERT({} USING utf8mb4), 'NULL')".format(field)
+        for field in fields
+        ])
+    query = compose_select(
+        table,
+        '{0} DIV {1:d} AS range_id, COUNT(*),'
+        " BIT_XOR(CRC32(CONCAT_WS('|', {2})))".format(
+            source_table_key, size, columns),
+        where=where,
+        ) + ' GROUP BY range_id'
+    return query
+
+
+def compose_update(table, fields, where=None):
     """Compose update query string for migrated table.
 
     Arguments
@@ -355,6 +787,8 @@ def compose_update(table, fields):
         Real table name.
     fields : str
         List of table fields.
+    where : str
+        Optional condition restricting updated records.
 
     Returns
     -------
@@ -364,18 +798,20 @@ def compose_update(table, fields):
 
     """
     query = 'UPDATE {} SET {}'.format(table, fields)
+    if where:
+        query += ' WHERE {}'.format(where)
     return query
 
 
-def compose_update_register(register, table, fields):
+def compose_update_register(register, tables, fields):
     """Compose update query string for registration table.
 
     Arguments
     ---------
     register : str
         Real name of a registration table.
-    table : str
-        Real name of a migrated table.
+    tables : list of str
+        Real names of migrated tables.
     fields : str
         List of table fields.
 
@@ -386,10 +822,37 @@ def compose_update_register(register, table, fields):
         for field values.
 
     """
-    # Extract table root
-    root = table.replace(target_table_prefix_codelist, '', 1).replace(
-        target_table_prefix_agenda, '', 1)
-    query = "UPDATE {} SET {} WHERE alias='{}'".format(register, fields, root)
+    # Extract table roots
+    roots = ', '.join([
+        "'{}'".format(
+            table.replace(target_table_prefix_codelist, '', 1).replace(
+                target_table_prefix_agenda, '', 1)
+            )
+        for table in tables
+        ])
+    query = "UPDATE {} SET {} WHERE alias IN ({})".format(
+        register, fields, roots)
+    return query
+
+
+def compose_delete(table, where):
+    """Compose delete command string.
+
+    Arguments
+    ---------
+    table : str
+        Real table name.
+    where : str
+        Condition of deleted records.
+
+    Returns
+    -------
+    str
+        Command string with real table name. However, it can contain
+        placeholders for parameters of the condition.
+
+    """
+    query = 'DELETE FROM {} WHERE {}'.format(table, where)
     return query
 
 
@@ -411,6 +874,113 @@ def compose_truncate(table):
     return query
 
 
+def compose_create_like(table, template):
+    """Compose command string creating an empty copy of a table.
+
+    Arguments
+    ---------
+    table : str
+        Real name of a created table.
+    template : str
+        Real name of a table, which structure is copied.
+
+    Returns
+    -------
+    str
+        Command string with real table names.
+
+    """
+    query = 'CREATE TABLE {} LIKE {}'.format(table, template)
+    return query
+
+
+def compose_drop(table):
+    """Compose command string dropping a table, if it exists.
+
+    Arguments
+    ---------
+    table : str
+        Real table name.
+
+    Returns
+    -------
+    str
+        Command string with real table name.
+
+    """
+    query = 'DROP TABLE IF EXISTS {}'.format(table)
+    return query
+
+
+def compose_swap(table, shadow, old):
+    """Compose command string atomically replacing a table with its copy.
+
+    Arguments
+    ---------
+    table : str
+        Real name of a live table.
+    shadow : str
+        Real name of a loaded copy of the live table.
+    old : str
+        Real name, under which the replaced live table is kept.
+
+    Returns
+    -------
+    str
+        Command string renaming both tables in one atomic operation.
+
+    """
+    query = 'RENAME TABLE {0} TO {2}, {1} TO {0}'.format(table, shadow, old)
+    return query
+
+
+def compose_indexlist(tables, fields):
+    """Compose query for table fields leading some index.
+
+    Arguments
+    ---------
+    tables : list of str
+        Real table names in the current database.
+    fields : list of str
+        Names of table fields.
+
+    Returns
+    -------
+    str
+        Query string returning pairs of a table name and a field name, which
+        is the first field of an index of that table.
+
+    """
+    names = ', '.join(["'{}'".format(table) for table in tables])
+    columns = ', '.join(["'{}'".format(field) for field in fields])
+    query = 'SELECT DISTINCT TABLE_NAME, COLUMN_NAME' \
+        ' FROM information_schema.STATISTICS' \
+        ' WHERE TABLE_SCHEMA = DATABASE() AND SEQ_IN_INDEX = 1' \
+        ' AND TABLE_NAME IN ({}) AND COLUMN_NAME IN ({})'.format(
+            names, columns)
+    return query
+
+
+def compose_create_index(table, field):
+    """Compose command string creating an index for a table field.
+
+    Arguments
+    ---------
+    table : str
+        Real table name.
+    field : str
+        Name of an indexed table field.
+
+    Returns
+    -------
+    str
+        Command string with real table name and index named after the field.
+
+    """
+    query = 'CREATE INDEX idx_{1} ON {0} ({1})'.format(table, field)
+    return query
+
+
 def compose_tablelist(table_prefix):
     """Compose query for list of table names with particular prefix.
 
@@ -427,3 +997,52 @@ def compose_tablelist(table_prefix):
     """
     query = "SHOW TABLES LIKE '{}%'".format(table_prefix)
     return query
+
+
+def compose_union(tables, fields):
+    """Compose query with the same aggregation over several tables.
+
+    Arguments
+    ---------
+    tables : list of str
+        Real table names.
+    fields : str
+        List of aggregated fields.
+
+    Returns
+    -------
+    str
+        Query string returning a record for each table with its index in the
+        input list followed by aggregated fields.
+
+    """
+    query = ' UNION ALL '.join([
+        'SELECT {:d}, {} FROM {}'.format(index, fields, table)
+        for index, table in enumerate(tables)
+        ])
+    return query
+
+
+def compose_tablerows(tables, fields='TABLE_ROWS'):
+    """Compose query for estimated number of records of tables.
+
+    Arguments
+    ---------
+    tables : list of str
+        Real table names in the current database.
+    fields : str
+        List of columns of the information schema table TABLES.
+
+    Returns
+    -------
+    str
+        Query string returning table name and its estimated number of records
+        or other requested columns from the information schema, which does not
+        scan the tables.
+
+    """
+    names = ', '.join(["'{}'".format(table) for table in tables])
+    query = 'SELECT TABLE_NAME, {} FROM information_schema.TABLES' \
+        ' WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ({})'.format(
+            fields, names)
+    return query
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""Module with Python transformations of migrated records.
+
+Notes
+-----
+- Transformations compute derived target table fields over whole chunks of
+  records column by column, so that a target database gets plain values
+  instead of evaluating SQL expressions for each record.
+- A transformation is declared in the module `sql` as a tuple with a name of
+  a function from this module and names of record fields as its arguments.
+
+"""
+__version__ = '0.1.0'
+__status__ = 'Beta'
+__author__ = 'Libor Gabaj'
+__copyright__ = 'Copyright 2019, ' + __author__
+__credits__ = [__author__]
+__license__ = 'MIT'
+__maintainer__ = __author__
+__email__ = 'libor.gabaj@gmail.com'
+
+# Standard library modules
+import datetime
+import decimal
+
+
+###############################################################################
+# Column functions
+###############################################################################
+def ifnull(values, defaults):
+    """Equivalent of SQL expression IFNULL(value, default)."""
+    return [d if v is None else v for v, d in zip(values, defaults)]
+
+
+def iftrue(values):
+    """Equivalent of SQL expression IF(value, value, NULL)."""
+    return [v if v else None for v in values]
+
+
+def unit_price(prices, quantities):
+    """Equivalent of SQL expression
+    IF(quantity IN (0, 1), NULL, ROUND(price / quantity, 4)).
+
+    """
+    exponent = decimal.Decimal('0.0001')
+    column = []
+    for price, quantity in zip(prices, quantities):
+        if price is None or quantity is None or quantity in (0, 1):
+            column.append(None)
+            continue
+        value = decimal.Decimal(str(price)) / decimal.Decimal(str(quantity))
+        column.append(value.quantize(exponent, decimal.ROUND_HALF_UP))
+    return column
+
+
+def period(dates_on, dates_off):
+    """Equivalent of SQL expression DATEDIFF(date_off, date_on) + 1."""
+    def day(value):
+        if isinstance(value, datetime.datetime):
+            return value.date()
+        return value
+    return [
+        None if on is None or off is None else (day(off) - day(on)).days + 1
+        for on, off in zip(dates_on, dates_off)
+    ]
+
+
+###############################################################################
+# Chunk transformation
+###############################################################################
+def transform(records, transforms):
+    """Compute derived fields of a chunk of records.
+
+    Arguments
+    ---------
+    records : list of dict
+        Chunk of records, which are updated in place.
+    transforms : dict
+        Declarations of derived fields as tuples with a function name and
+        names of fields as function arguments.
+
+    Returns
+    -------
+    list of dict
+        Updated chunk of records.
+
+    Notes
+    -----
+    - All derived fields are computed from original fields, so that a derived
+      field can replace an original one with the same name.
+
+    """
+    if not records or not transforms:
+        return records
+    columns = {}
+    derived = {}
+    for field, (function, *keys) in transforms.items():
+        for key in keys:
+            if key not in columns:
+                columns[key] = [r[key] for r in records]
+        derived[field] = globals()[function](*[columns[k] for k in keys])
+    for field, column in derived.items():
+        for record, value in zip(records, column):
+            record[field] = value
+    return records
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 """Script for updating user ids in target codelist and agenda tables."""
-__version__ = '0.1.2'
+__version__ = '0.2.0'
 __status__ = 'Beta'
 __author__ = 'Libor Gabaj'
 __copyright__ = 'Copyright 2019, ' + __author__
@@ -12,11 +12,13 @@ __email__ = 'libor.gabaj@gmail.com'
 # Standard library modules
 import os
 import argparse
+import concurrent.futures
 import logging
 import mysql.connector as mysql
 
 # Third party modules
 import dbconfig as db
+import dbpool
 import sql
 
 
@@ -42,46 +44,14 @@ class Target:
     """Status parameters of the data target."""
 
     (
-        conn, query, cursor, table, database, codelists, agendas
-    ) = (None, None, None, None, None, None, None,)
+        conn, query, cursor, table, database, codelists, agendas,
+        CHUNK, COMMIT,
+    ) = (None, None, None, None, None, None, None, 10000, 1,)
 
 
 ###############################################################################
 # Actions
 ###############################################################################
-def connect_db(config):
-    """Connect to a database.
-
-    Arguments
-    ---------
-    config : dict
-        Connection configuration to a database.
-
-    Returns
-    -------
-    connection : object
-        Connection object to a database.
-
-    Raises
-    -------
-    mysql.connector.Error
-        Native exception of the database connector.
-
-    """
-    try:
-        conn = mysql.connect(**config)
-        logger.debug('Database %s connected', config['database'])
-        return conn
-    except mysql.Error as err:
-        if err.errno == mysql.errorcode.ER_ACCESS_DENIED_ERROR:
-            logger.error('Bad database %s credentials', config['database'])
-        elif err.errno == mysql.errorcode.ER_BAD_DB_ERROR:
-            logger.error('Database %s does not exist', config['database'])
-        else:
-            logger.error(err)
-        raise
-
-
 def target_open():
     """Connect to a target database.
 
@@ -93,7 +63,7 @@ def target_open():
     """
     if Target.conn is None:
         try:
-            Target.conn = connect_db(db.target_config)
+            Target.conn = dbpool.connect('target', size=cmdline.jobs + 1)
         except Exception:
             logger.error(
                 'Cannot connect to the target database %s',
@@ -111,6 +81,7 @@ def target_close():
     # Close connection to database
     if Target.conn is not None:
         Target.conn.close()
+    dbpool.close()
 
 
 ###############################################################################
@@ -162,9 +133,31 @@ def setup_cmdline():
         action='store_true',
         help='List of target codelist and agenda tables.'
     )
+    parser.add_argument(
+        '-k', '--chunk',
+        type=int,
+        default=Target.CHUNK,
+        help='Number of primary keys updated by a statement, default '
+             + str(Target.CHUNK) + '.'
+    )
+    parser.add_argument(
+        '--commit',
+        type=int,
+        default=Target.COMMIT,
+        help='Number of chunks updated in a transaction, default '
+             + str(Target.COMMIT) + '.'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=1,
+        help='Number of tables updated in parallel.'
+    )
     # Process command line arguments
     global cmdline
     cmdline = parser.parse_args()
+    if cmdline.chunk <= 0:
+        parser.error('argument -k/--chunk: must be a positive number')
 
 
 def setup_logger():
@@ -208,6 +201,71 @@ def tablelist(table_prefix):
         return None
 
 
+def update_table(table):
+    """Update user ids in a table by chunks of primary keys.
+
+    Arguments
+    ---------
+    table : str
+        Name of a table to be updated.
+
+    Returns
+    -------
+    int
+        Number of changed records or None at failure.
+
+    Notes
+    -----
+    - The function uses its own pooled connection, so that tables can be
+      updated in parallel threads.
+    - Only records with differing user ids are changed.
+
+    """
+    key = sql.source_table_key
+    where = sql.source_table_range + ' AND ' + sql.target_users_differ
+    query = sql.compose_update(table, sql.target_users, where)
+    rows = 0
+    try:
+        conn = dbpool.connect('target')
+    except Exception:
+        return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql.compose_select(
+            table, 'MIN({0}), MAX({0})'.format(key), sql.target_users_differ),
+            {'user': cmdline.user}
+            )
+        first, last = cursor.fetchone()
+        chunks = 0
+        while first is not None and first <= last:
+            cursor.execute(query, {
+                'user': cmdline.user,
+                'range_first': first,
+                'range_last': first + cmdline.chunk - 1,
+                })
+            rows += cursor.rowcount
+            first += cmdline.chunk
+            chunks += 1
+            if chunks % max(cmdline.commit, 1) == 0:
+                conn.commit()
+        conn.commit()
+        logger.debug(
+            'Updated %d records in table %s.%s with user %d',
+            rows,
+            Target.database,
+            table,
+            cmdline.user
+            )
+        return rows
+    except mysql.Error as err:
+        logger.error(err)
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
 def update_users(table_list):
     """Update user ids in tables from provided list.
 
@@ -218,33 +276,20 @@ def update_users(table_list):
 
     Returns
     -------
-    int
-        Number of updated tables.
+    tuple of int
+        Number of updated tables and number of changed records.
 
     """
-    tables = 0
+    tables = rows = 0
     if not isinstance(table_list, list):
-        return tables
-    for table in table_list:
-        Target.table = table
-        Target.query = sql.compose_update(
-            table=Target.table,
-            fields=sql.target_users,
-            )
-        Target.cursor = Target.conn.cursor()
-        try:
-            Target.cursor.execute(Target.query, {'user': cmdline.user})
-            tables += 1
-            logger.debug(
-                'Updated %d records in table %s.%s with user %d',
-                Target.cursor.rowcount,
-                Target.database,
-                Target.table,
-                cmdline.user
-                )
-        except mysql.Error as err:
-            logger.error(err)
-    return tables
+        return tables, rows
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(cmdline.jobs, 1)) as executor:
+        for changed in executor.map(update_table, table_list):
+            if changed is not None:
+                tables += 1
+                rows += changed
+    return tables, rows
 
 
 def main():
@@ -276,17 +321,21 @@ def main():
     if cmdline.codelists or cmdline.agendas:
         if cmdline.user:
             if cmdline.codelists:
-                tables = update_users(Target.codelists)
+                tables, rows = update_users(Target.codelists)
                 logger.info(
-                    'Updated %d codelist tables with user %d',
+                    'Updated %d codelist tables with %d changed records'
+                    ' with user %d',
                     tables,
+                    rows,
                     cmdline.user,
                     )
             if cmdline.agendas:
-                tables = update_users(Target.agendas)
+                tables, rows = update_users(Target.agendas)
                 logger.info(
-                    'Updated %d agenda tables with user %d',
+                    'Updated %d agenda tables with %d changed records'
+                    ' with user %d',
                     tables,
+                    rows,
                     cmdline.user,
                     )
         else:
@@ -1,6 +1,14 @@
 # -*- coding: utf-8 -*-
-"""Script for migrating agendas from MS Excel to Family Chronicle."""
-__version__ = '0.1.0'
+"""Script for migrating agendas from MS Excel to Family Chronicle.
+
+Notes
+-----
+- Agendas can be read from MS Excel workbooks as well as from CSV or TSV
+  exports of their sheets. A CSV or TSV file is a single sheet named after
+  the file.
+
+"""
+__version__ = '0.4.0'
 __status__ = 'Beta'
 __author__ = 'Libor Gabaj'
 __copyright__ = 'Copyright 2019, ' + __author__
@@ -12,14 +20,25 @@ __email__ = 'libor.gabaj@gmail.com'
 # Standard library modules
 import os
 import argparse
+import codecs
+import csv
+import glob
 import logging
 import mysql.connector as mysql
 import openpyxl
+import openpyxl.utils
+import openpyxl.utils.cell
 import datetime
-import dataclasses
+import decimal
+import multiprocessing
+import multiprocessing.util
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ElementTree
 
 # Custom library modules
 import dbconfig as db
+import dbpool
 import sql
 
 
@@ -52,35 +71,63 @@ class Source:
     """Parameters of the data source."""
 
     (
-        file, wbook, wsheet, agenda,
-    ) = (None, None, None, None)
+        file, reader, sheet, agenda, row, comments,
+    ) = (None, None, None, None, None, None)
+
+
+class Xlsx:
+    """XML namespaces of parts of a MS Excel workbook file."""
+
+    (
+        MAIN, RELS, PACKAGE, COMMENTS,
+    ) = (
+        '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}',
+        '{http://schemas.openxmlformats.org/officeDocument/2006/'
+        'relationships}',
+        '{http://schemas.openxmlformats.org/package/2006/relationships}',
+        'http://schemas.openxmlformats.org/officeDocument/2006/'
+        'relationships/comments',
+    )
+
+
+class Batch:
+    """Parameters of batched inserting of rows."""
+
+    (
+        records, signature, queries, batches, errors, SIZE, COMMIT,
+    ) = ([], None, {}, 0, 0, 1000, 1,)
 
 
 class Target:
     """Parameters of the data target."""
 
     (
-        host, conn, query, cursor, table, database, root, register,
-    ) = (None, None, None, None, None, None, None, None,)
+        host, conn, query, cursor, table, database, root, register, load,
+    ) = (None, None, None, None, None, None, None, None, None,)
 
 
-@dataclasses.dataclass
 class Column:
     """MS Excel column definition of an agenda."""
-    title: str
-    datatype: str
-    dbfield: str
-    index: int = None
-    optional: bool = False
-    value: any = None
-    comment: str = None
-    rounding: int = None
+
+    __slots__ = ('title', 'datatype', 'dbfield', 'index', 'optional',
+                 'rounding')
+
+    def __init__(self, title: str, datatype: str, dbfield: str,
+                 index: int = None, optional: bool = False,
+                 rounding: int = None):
+        self.title = title
+        self.datatype = datatype
+        self.dbfield = dbfield
+        self.index = index
+        self.optional = optional
+        self.rounding = rounding
+
+    def __repr__(self):
+        return f'Column({self.title!r}, {self.datatype!r}, {self.dbfield!r})'
 
     def reset(self):
-        """Initialize dynamic fields of a data record."""
+        """Initialize dynamic fields of a column."""
         self.index = None
-        self.value = None
-        self.comment = None
 
 
 class Agenda(object):
@@ -92,7 +139,8 @@ class Agenda(object):
 
     @property
     def dbfields(self) -> dict:
-        """Common table fields for all target database tables."""
+        """Common table fields for all target database tables except
+        the description."""
         now = datetime.datetime.now()
         return {
             'params': '',
@@ -103,19 +151,8 @@ class Agenda(object):
             'created_by': Params.juser,
             'modified': now,
             'modified_by': Params.juser,
-            'description': self.comments,
         }
 
-    @property
-    def ins_fields(self) -> str:
-        """Comma separated list of table fields for insert SQL query."""
-        return ','.join(self.dbfields.keys())
-
-    @property
-    def ins_values(self) -> str:
-        """Comma separated list of values placeholders for insert SQL."""
-        return ','.join([f'%({k})s' for k in self.dbfields.keys()])
-
     @property
     def header_row(self) -> int:
         """Number of a header row in a workbook."""
@@ -140,12 +177,6 @@ class Agenda(object):
                 cols += 1
         return cols
 
-    @property
-    def comments(self) -> str:
-        """Cummulative comment from all workbook cells."""
-        l = [c.comment.content for c in self.coldefs if c.comment]
-        return '\n'.join(l)
-
     def reset(self):
         """Reset all dynamic properties of all data fields of an agenda."""
         for col in self.coldefs:
@@ -173,19 +204,12 @@ class Agenda(object):
           characters with space.
 
         """
-        title = title.replace('\n', ' ')
+        title = str(title).replace('\n', ' ')
         for cn, col in enumerate(self.coldefs):
             if col.title == title:
                 col.index = colnum
                 return cn
 
-    def check_row(self) -> bool:
-        """Test for all mandatory data fields on determined value."""
-        for col in self.coldefs:
-            if not (col.optional or col.value is not None):
-                return False
-        return True
-
     def check_agenda(self) -> bool:
         """Check presence of all mandatory data fields
         and at least one optional one in a data record.
@@ -200,52 +224,116 @@ class Agenda(object):
                 flag_optional_fields = True
         return flag_mandatory_fields and flag_optional_fields
 
-    def get_column_by_dbfield(self, dbfield: str) -> Column:
-        """Find column object by database field name in the data record."""
-        for col in self.coldefs:
+    def get_column_by_dbfield(self, dbfield: str) -> int:
+        """Find position of a column by database field name in the data
+        record."""
+        for cn, col in enumerate(self.coldefs):
             if col.dbfield == dbfield:
-                return col
+                return cn
 
-    def get_column_by_index(self, index: int) -> Column:
-        """Find column object by column index in a workbook."""
-        for col in self.coldefs:
-            if col.index == index:
-                return col
+    def fields(self, mask: tuple) -> tuple:
+        """Table fields of records encoded with a mask.
 
-    def store_cell(self, cell: object, colnum: int) -> Column:
-        """Store value and comment from a workbook cell in a column
-        and return that column object for chaining.
+        Arguments
+        ---------
+        mask : tuple of int
+            Positions of columns with values in a data record.
+
+        Returns
+        -------
+        tuple of str
+            Table fields in the order of encoded parameters.
 
         """
-        coldef = self.get_column_by_index(colnum)
-        coldef.value = None
-        coldef.comment = None
-        if not cell.value:
-            return
-        if cell.data_type == coldef.datatype:
-            coldef.value = cell.value
-            coldef.comment = cell.comment
-            return self.round_column(coldef)
-        else:
-            logger.error(
-                'Ignored cell "%s!%s%s" ' \
-                'with unexpected data type "%s" ' \
-                'for column "%s"',
-                Source.wsheet.title,
-                cell.column_letter,
-                cell.row,
-                cell.data_type,
-                coldef.title
-            )
+        return tuple([self.coldefs[cn].dbfield for cn in mask]) \
+            + tuple(self.dbfields) + ('description',)
 
-    def round_column(self, coldef: Column) -> Column:
-        """Round a data field value in a column definition, if it is of some
-        numeric type and rounding is declared in the column definition.
+    def derive(self, values: list):
+        """Compute values of data fields from other ones in a data record.
+
+        Arguments
+        ---------
+        values : list
+            Values of a data record in the order of column definitions, which
+            are updated in place.
+
+        """
+
+    def compile(self, convert: callable = None) -> callable:
+        """Compile an encoder of workbook rows after header detection.
+
+        Arguments
+        ---------
+        convert : callable
+            Optional function converting a raw cell value to a column data
+            type, which is provided by a source reader.
+
+        Returns
+        -------
+        callable
+            Function encoding a tuple of row values to a pair of a mask and
+            a tuple of insert parameters, or to None, if the row lacks some
+            mandatory value. The mask is a tuple of positions of columns
+            with values and determines table fields by the method `fields`.
+
+        Notes
+        -----
+        - Common table fields are computed once for all encoded rows.
+        - Only non-empty cells of expected data type are stored. A cell with
+          another data type is ignored and logged.
 
         """
-        if coldef.rounding and coldef.datatype in ['n', 'f']:
-            coldef.value = round(coldef.value, coldef.rounding)
-        return coldef
+        slots = [
+            (
+                col.index, cn, col.datatype, col.title,
+                col.rounding if col.datatype in ['n', 'f'] else None,
+            )
+            for cn, col in enumerate(self.coldefs) if col.index is not None
+        ]
+        mandatory = [
+            cn for cn, col in enumerate(self.coldefs) if not col.optional
+        ]
+        positions = range(len(self.coldefs))
+        constants = tuple(self.dbfields.values())
+        derive = self.derive
+
+        def encode(row: tuple) -> tuple:
+            values = [None] * len(positions)
+            comments = []
+            for colnum, cn, datatype, title, rounding in slots:
+                value = row[colnum] if colnum < len(row) else None
+                if not value:
+                    continue
+                if convert:
+                    value = convert(value, datatype)
+                if data_type(value) != datatype:
+                    logger.error(
+                        'Ignored cell "%s!%s%s" ' \
+                        'with unexpected data type "%s" ' \
+                        'for column "%s"',
+                        Source.sheet,
+                        openpyxl.utils.get_column_letter(colnum + 1),
+                        Source.row,
+                        data_type(value),
+                        title
+                    )
+                    continue
+                if rounding:
+                    value = round(value, rounding)
+                values[cn] = value
+                comment = cell_comment(colnum)
+                if comment:
+                    comments.append(comment)
+            derive(values)
+            for cn in mandatory:
+                if values[cn] is None:
+                    return None
+            mask = tuple([cn for cn in positions if values[cn]])
+            params = tuple([values[cn] for cn in mask]) + constants \
+                + ('\n'.join(comments),)
+            return mask, params
+
+        return encode
 
 
 ###############################################################################
@@ -264,32 +352,272 @@ class Income(Agenda):
             Column('Suma Sk', 'n', 'price_orig', optional=True, rounding=2),
             Column('Currency', 'n', 'id_currency', optional=True),
         ]
+        self._price = self.get_column_by_dbfield('price')
+        self._price_orig = self.get_column_by_dbfield('price_orig')
+        self._currency = self.get_column_by_dbfield('id_currency')
+
+    def derive(self, values: list):
+        """Convert original price in Slovak crowns to euros."""
+        if values[self._price_orig]:
+            values[self._price] = round(
+                values[self._price_orig] / Params.skeu,
+                self.coldefs[self._price].rounding
+                )
+            values[self._currency] = Params.jskccy
+
+
+###############################################################################
+# Source readers
+###############################################################################
+class Reader(object):
+    """Streaming reader of sheets of a source file.
+
+    Arguments
+    ---------
+    path : str
+        Path to a source file.
+    encoding : str
+        Encoding of a text source file, detected if not provided.
+
+    """
+
+    def __init__(self, path: str, encoding: str = None):
+        """Create the class instance - constructor."""
+        self.path = path
+        self.encoding = encoding
 
     @property
-    def dbfields(self) -> dict:
-        """Adding specific table fields for the agenda to common ones."""
-        fields = {col.dbfield: col.value for col in self.coldefs if col.value}
-        fields.update(super().dbfields)
-        return fields
-
-    def store_cell(self, cell: object, colnum: int) -> Column:
-        """Additional specific actions at storing a workbook cell."""
-        coldef = super().store_cell(cell, colnum)
-        if coldef and coldef.value:
-            if coldef.dbfield == 'price_orig':
-                pricedef = self.get_column_by_dbfield('price')
-                pricedef.value = coldef.value / Params.skeu
-                self.round_column(pricedef)
-                ccydef = self.get_column_by_dbfield('id_currency')
-                ccydef.value = Params.jskccy
-        return coldef
+    def sheetnames(self) -> list:
+        """Titles of sheets of the source file."""
+        return []
+
+    def rows(self, title: str) -> iter:
+        """Iterate over rows of a sheet as tuples of cell values."""
+        return iter(())
+
+    def comments(self, title: str) -> dict:
+        """Comment texts of a sheet keyed by tuples of row number counting
+        from 1 and column number counting from 0."""
+        return {}
+
+    def convert(self, value: any, datatype: str) -> any:
+        """Convert a raw cell value to a column data type."""
+        return value
+
+    def close(self):
+        """Release the source file."""
+
+
+class XlsxReader(Reader):
+    """Streaming reader of sheets of a MS Excel workbook.
+
+    Notes
+    -----
+    - The workbook is opened in read-only mode, so that its rows are streamed
+      from the file and never held in memory entirely.
+    - Cached values of formulas are read instead of formulas themselves.
+    - Cell values are already typed, so that they are not converted.
+
+    """
+
+    def __init__(self, path: str, encoding: str = None):
+        """Create the class instance - constructor."""
+        super().__init__(path, encoding)
+        self._wbook = openpyxl.load_workbook(
+            path,
+            read_only=True,
+            data_only=True,
+        )
+
+    @property
+    def sheetnames(self) -> list:
+        """Titles of sheets of the workbook."""
+        return self._wbook.sheetnames
+
+    def rows(self, title: str) -> iter:
+        """Iterate over rows of a sheet as tuples of cell values."""
+        return self._wbook[title].iter_rows(values_only=True)
+
+    def comments(self, title: str) -> dict:
+        """Read comments of a workbook sheet directly from the workbook file.
+
+        Notes
+        -----
+        - Sheets in read-only mode provide no comments, so they are parsed
+          from the comments part of the sheet, which is small compared to
+          the sheet.
+
+        """
+        def part_path(base: str, target: str) -> str:
+            """Resolve a relationship target relative to a part."""
+            if target.startswith('/'):
+                return target.lstrip('/')
+            return posixpath.normpath(
+                posixpath.join(posixpath.dirname(base), target))
+
+        def rels_path(part: str) -> str:
+            """Path of relationships of a part."""
+            folder, name = posixpath.split(part)
+            return posixpath.join(folder, '_rels', name + '.rels')
+
+        def relationships(archive: zipfile.ZipFile, part: str) -> list:
+            """List of relationships of a part."""
+            try:
+                root = ElementTree.fromstring(archive.read(rels_path(part)))
+            except KeyError:
+                return []
+            return root.iter(Xlsx.PACKAGE + 'Relationship')
+
+        comments = {}
+        workbook = 'xl/workbook.xml'
+        with zipfile.ZipFile(self.path) as archive:
+            root = ElementTree.fromstring(archive.read(workbook))
+            rels = {
+                rel.get('Id'): part_path(workbook, rel.get('Target'))
+                for rel in relationships(archive, workbook)
+            }
+            sheet = None
+            for elem in root.iter(Xlsx.MAIN + 'sheet'):
+                if elem.get('name') == title:
+                    sheet = rels.get(elem.get(Xlsx.RELS + 'id'))
+                    break
+            if sheet is None:
+                return comments
+            for rel in relationships(archive, sheet):
+                if rel.get('Type') != Xlsx.COMMENTS:
+                    continue
+                part = part_path(sheet, rel.get('Target'))
+                root = ElementTree.fromstring(archive.read(part))
+                for elem in root.iter(Xlsx.MAIN + 'comment'):
+                    row, column = openpyxl.utils.cell.coordinate_to_tuple(
+                        elem.get('ref'))
+                    texts = [
+                        t.text or '' for t in elem.iter(Xlsx.MAIN + 't')
+                    ]
+                    comments[(row, column - 1)] = ''.join(texts)
+        return comments
+
+    def close(self):
+        """Close the workbook file."""
+        self._wbook.close()
+
+
+class CsvReader(Reader):
+    """Streaming reader of a CSV or TSV export of a sheet.
+
+    Notes
+    -----
+    - The file is a single sheet titled by the file name without extension.
+    - Files with extensions '.tsv' and '.tab' are separated by tabulators,
+      other files by a delimiter detected from their beginning.
+    - Without explicit encoding the first of encodings, which decodes the
+      beginning of the file, is used, i.e., UTF-8 or Windows Central European
+      code page of Slovak exports.
+    - Rows are parsed by the standard csv module and cell values are
+      converted to column data types only for stored columns.
+    - The file has no comments.
+
+    """
+
+    (
+        TABS, DELIMITERS, SAMPLE, ENCODINGS, DATE_FORMATS,
+    ) = (
+        ('.tsv', '.tab'), ',;\t', 65536, ('utf-8-sig', 'cp1250'),
+        ('%Y-%m-%d', '%d.%m.%Y', '%Y-%m-%d %H:%M:%S', '%d.%m.%Y %H:%M:%S',
+         '%d.%m.%Y %H:%M', '%d/%m/%Y'),
+    )
+
+    def __init__(self, path: str, encoding: str = None):
+        """Create the class instance - constructor."""
+        super().__init__(path, encoding or CsvReader.detect(path))
+        self._title = os.path.splitext(os.path.basename(path))[0]
+        self._file = open(path, newline='', encoding=self.encoding)
+        if os.path.splitext(path)[1].lower() in CsvReader.TABS:
+            self._dialect = csv.excel_tab
+        else:
+            sample = self._file.read(CsvReader.SAMPLE)
+            try:
+                self._dialect = csv.Sniffer().sniff(
+                    sample, CsvReader.DELIMITERS)
+            except csv.Error:
+                self._dialect = csv.excel
+
+    @staticmethod
+    def detect(path: str) -> str:
+        """Detect encoding of a file from its beginning."""
+        with open(path, 'rb') as file:
+            sample = file.read(CsvReader.SAMPLE)
+        for encoding in CsvReader.ENCODINGS:
+            try:
+                codecs.getincrementaldecoder(encoding)().decode(sample)
+                return encoding
+            except UnicodeDecodeError:
+                continue
+        return CsvReader.ENCODINGS[0]
+
+    @property
+    def sheetnames(self) -> list:
+        """Title of the only sheet of the file."""
+        return [self._title]
+
+    def rows(self, title: str) -> iter:
+        """Iterate over rows of the file as tuples of strings."""
+        self._file.seek(0)
+        return map(tuple, csv.reader(self._file, self._dialect))
+
+    def convert(self, value: any, datatype: str) -> any:
+        """Convert a cell string to a column data type.
+
+        Notes
+        -----
+        - Numbers may contain spaces as thousands separators and a decimal
+          comma.
+        - A string, which cannot be converted, is returned unchanged, so that
+          it is rejected as a value of unexpected data type.
+
+        """
+        value = value.strip()
+        if datatype == 'n':
+            number = value.replace(' ', '').replace('\xa0', '')
+            try:
+                return int(number)
+            except ValueError:
+                pass
+            try:
+                return float(number.replace(',', '.'))
+            except ValueError:
+                return value
+        if datatype == 'd':
+            for date_format in CsvReader.DATE_FORMATS:
+                try:
+                    return datetime.datetime.strptime(value, date_format)
+                except ValueError:
+                    pass
+        return value
+
+    def close(self):
+        """Close the file."""
+        self._file.close()
+
+
+READERS = {
+    '.csv': CsvReader,
+    '.tsv': CsvReader,
+    '.tab': CsvReader,
+    '.txt': CsvReader,
+}
 
 
 ###############################################################################
-# MS Excel actions
+# Source actions
 ###############################################################################
-def source_open() -> bool:
-    """Open a source MS Excel spreadsheet file.
+def source_open(workbook: str) -> bool:
+    """Open a source workbook or its sheet export file.
+
+    Arguments
+    ---------
+    workbook : str
+        Path to a workbook file or a CSV or TSV file.
 
     Returns
     -------
@@ -297,17 +625,116 @@ def source_open() -> bool:
         Flag about successful processing.
 
     """
+    if Source.reader is not None and Source.file == workbook:
+        return True
+    source_close()
+    extension = os.path.splitext(workbook)[1].lower()
+    reader = READERS.get(extension, XlsxReader)
     try:
-        Source.wbook = openpyxl.load_workbook(cmdline.workbook)
+        Source.reader = reader(workbook, cmdline.encoding)
+    except UnicodeDecodeError as err:
+        logger.error(
+            'Cannot decode the source file %s as %s, see --encoding',
+            workbook,
+            err.encoding
+        )
+        return False
     except Exception:
         logger.error(
-            'Cannot open the MS Excel workbook %s',
-            cmdline.workbook
+            'Cannot open the source file %s',
+            workbook
         )
         return False
+    Source.file = workbook
     return True
 
 
+def source_close():
+    """Close a source file."""
+    if Source.reader is not None:
+        Source.reader.close()
+    Source.file = None
+    Source.reader = None
+    Source.sheet = None
+    Source.comments = None
+
+
+def source_sheets(patterns: list) -> list:
+    """List sheets of workbooks for migration.
+
+    Arguments
+    ---------
+    patterns : list of str
+        Paths to workbook files or their glob patterns.
+
+    Returns
+    -------
+    list of tuple
+        Pairs of a workbook path and a sheet title in the order of workbooks
+        and their sheets.
+
+    """
+    sheets = []
+    for pattern in patterns:
+        for workbook in sorted(glob.glob(pattern)) or [pattern]:
+            if not source_open(workbook):
+                continue
+            sheets.extend([(workbook, title)
+                           for title in Source.reader.sheetnames])
+    source_close()
+    return sheets
+
+
+def data_type(value: any) -> str:
+    """Determine MS Excel data type of a cell value.
+
+    Arguments
+    ---------
+    value : any
+        Value of a workbook cell.
+
+    Returns
+    -------
+    str
+        Data type code of openpyxl cells, i.e., 'd' for datetimes, 's' for
+        strings, 'b' for booleans, and 'n' for numbers.
+
+    """
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time,
+                          datetime.timedelta)):
+        return 'd'
+    if isinstance(value, str):
+        return 's'
+    if isinstance(value, bool):
+        return 'b'
+    if isinstance(value, (int, float, decimal.Decimal)):
+        return 'n'
+    return None
+
+
+def cell_comment(colnum: int) -> str:
+    """Find comment of a cell in the current row of the current sheet.
+
+    Arguments
+    ---------
+    colnum : int
+        Column number of a cell counting from 0.
+
+    Returns
+    -------
+    str
+        Comment text or None, if the cell has no comment.
+
+    Notes
+    -----
+    - Comments of a sheet are read at the first request for a comment.
+
+    """
+    if Source.comments is None:
+        Source.comments = Source.reader.comments(Source.sheet)
+    return Source.comments.get((Source.row, colnum))
+
+
 def migrate_sheet() -> bool:
     """Migrate workbook to the target agenda.
 
@@ -316,95 +743,260 @@ def migrate_sheet() -> bool:
     boolean
         Flag about successful processing.
 
+    Notes
+    -----
+    - Rows of a sheet are read in a single pass as tuples of cell values.
+      Rows before the header one are skipped, and the following ones are
+      encoded by the row encoder compiled by the agenda for the sheet.
+
     """
     a = Source.agenda
     a.reset()
-    # Header row - First one with non-empty first column
-    for row in Source.wsheet.iter_rows(min_row=1):
-        cell = row[0]
-        if cell.value:
-            a.header_row = cell.row
-            for cn, cell in enumerate(row):
-                a.set_column_index(cell.value, cn)
+    a.header_row = None
+    Source.comments = None
+    encode = None
+    errors = Batch.errors
+    rows = 0
+    for Source.row, row in enumerate(
+        Source.reader.rows(Source.sheet),
+        start=1
+    ):
+        # Header row - First one with non-empty first column
+        if a.header_row is None:
+            if not (row and row[0]):
+                continue
+            a.header_row = Source.row
+            for cn, value in enumerate(row):
+                if value is not None:
+                    a.set_column_index(value, cn)
             if not a.check_agenda():
                 msg = 'Uknown agenda structure'
                 logger.error(msg)
                 return False
-            break
+            encode = a.compile(Source.reader.convert)
+            continue
+        # Ignore row with empty date column
+        record = encode(row)
+        if record is None:
+            continue
+        # Insert row to target table
+        rows += write_row(*record)
+    rows += flush_rows()
+    try:
+        Target.conn.commit()
+    except mysql.Error as err:
+        Batch.errors += 1
+        logger.error(err)
     if not a.header_row:
         msg = 'No header row detected.'
         logger.error(msg)
         return False
-    # Data rows
-    rows = 0
-    for row in Source.wsheet.iter_rows(
-        min_row=a.header_row + 1,
-        max_col=a.columns
-    ):
-        # Process columns of a row
-        for cn, cell in enumerate(row):
-            a.store_cell(cell, cn)
-        # Ignore row with empty date column
-        if not a.check_row():
-            continue
-        # Insert row to target table
-        Target.query = sql.compose_insert(
-            table=Target.table,
-            fields=a.ins_fields,
-            values=a.ins_values,
-            )
-        Target.cursor = Target.conn.cursor()
-        try:
-            Target.cursor.execute(Target.query, a.dbfields)
-            rows += 1
-        except mysql.Error as err:
-            logger.error(err)
     Params.rows += rows
     logger.info(
-        '%d rows from sheet "%s"',
+        '%d rows from sheet "%s" of workbook "%s"',
         rows,
-        Source.wsheet.title,
+        Source.sheet,
+        os.path.basename(Source.file),
     )
+    if Batch.errors > errors:
+        logger.error(
+            '%d rows or transactions of sheet "%s" failed',
+            Batch.errors - errors,
+            Source.sheet,
+        )
+        return False
+    return True
+
+
+def migrate_job(job: tuple) -> tuple:
+    """Migrate a sheet of a workbook.
+
+    Arguments
+    ---------
+    job : tuple
+        Pair of a workbook path and a sheet title.
+
+    Returns
+    -------
+    tuple
+        Number of migrated rows and flag about successful processing.
+
+    """
+    workbook, title = job
+    rows = Params.rows
+    success = False
+    if target_open() and source_open(workbook):
+        Source.sheet = title
+        try:
+            success = migrate_sheet()
+        except UnicodeDecodeError as err:
+            logger.error(
+                'Sheet "%s" of file "%s" cannot be decoded as %s,'
+                ' see --encoding',
+                title,
+                os.path.basename(workbook),
+                err.encoding,
+            )
+            Batch.records = []
+        except Exception as err:
+            logger.error(
+                'Sheet "%s" of workbook "%s" failed: %s',
+                title,
+                os.path.basename(workbook),
+                err,
+            )
+            Batch.records = []
+    return Params.rows - rows, success
+
+
+def worker_init(args: object, load: str):
+    """Initialize a worker process of parallel migration.
+
+    Arguments
+    ---------
+    args : object
+        Command line arguments of the parent process.
+    load : str
+        Name of the table for loading prepared by the parent process.
+
+    Notes
+    -----
+    - Each worker opens workbooks by itself and loads rows by its own
+      connection, which it keeps for all its sheets.
+
+    """
+    global cmdline
+    cmdline = args
+    setup_params()
+    setup_logger()
+    setup_agenda()
+    Target.conn = Target.cursor = None
+    Target.load = load
+    multiprocessing.util.Finalize(None, source_close, exitpriority=10)
+    multiprocessing.util.Finalize(None, target_close, exitpriority=10)
+
+
+def migrate_sheets(sheets: list) -> int:
+    """Migrate sheets sequentially or in a pool of worker processes.
+
+    Arguments
+    ---------
+    sheets : list of tuple
+        Pairs of a workbook path and a sheet title.
+
+    Returns
+    -------
+    tuple
+        Number of migrated rows and flag about successful processing of all
+        sheets.
+
+    """
+    if cmdline.jobs <= 1 or len(sheets) <= 1:
+        results = [migrate_job(job) for job in sheets]
+    else:
+        # Workers use their own connections
+        load = Target.load
+        target_close()
+        with multiprocessing.Pool(
+                cmdline.jobs, worker_init, (cmdline, load)) as pool:
+            results = list(pool.imap_unordered(migrate_job, sheets))
+            pool.close()
+            pool.join()
+        setup_agenda()
+        Target.load = load
+    rows = sum([result[0] for result in results])
+    success = all([result[1] for result in results])
+    return rows, success
 
 
 ###############################################################################
 # Database actions
 ###############################################################################
-def connect_db(config: dict) -> object:
-    """Connect to a database.
+def write_row(mask: tuple, params: tuple) -> int:
+    """Add a row to the batch of inserted rows.
 
     Arguments
     ---------
-    config : dict
-        Connection configuration to a database.
+    mask : tuple of int
+        Mask of an encoded row determining its table fields.
+    params : tuple
+        Insert parameters of an encoded row.
 
     Returns
     -------
-    connection : object
-        Connection object to a database.
+    int
+        Number of inserted rows, if a batch has been written.
+
+    Notes
+    -----
+    - A batch contains only records with the same fields, so that they are
+      inserted by the same statement. A record with other fields writes the
+      current batch first.
 
-    Raises
+    """
+    rows = 0
+    if mask != Batch.signature:
+        rows += flush_rows()
+        Batch.signature = mask
+    Batch.records.append(params)
+    if len(Batch.records) >= cmdline.batch:
+        rows += flush_rows()
+    return rows
+
+
+def flush_rows() -> int:
+    """Insert the batch of rows to the target table.
+
+    Returns
     -------
-    mysql.connector.Error
-        Native exception of the database connector.
+    int
+        Number of inserted rows.
+
+    Notes
+    -----
+    - The insert statement is composed once for each set of fields.
+    - Transaction is committed after each configured number of batches.
+    - If a batch fails, its rows are inserted one by one, so that only
+      wrong rows are rejected. Rejected rows and failed commits are counted
+      as errors.
 
     """
-    try:
-        conn = mysql.connect(**config)
-        logger.debug(
-            'Database "%s//%s" connected',
-            config['host'],
-            config['database'],
+    if not Batch.records:
+        return 0
+    records, Batch.records = Batch.records, []
+    key = (Target.load, Batch.signature)
+    Target.query = Batch.queries.get(key)
+    if Target.query is None:
+        fields = Source.agenda.fields(Batch.signature)
+        Target.query = sql.compose_insert(
+            table=Target.load,
+            fields=','.join(fields),
+            values=','.join(['%s'] * len(fields)),
             )
-        return conn
+        Batch.queries[key] = Target.query
+    if Target.cursor is None:
+        Target.cursor = Target.conn.cursor()
+    rows = 0
+    try:
+        Target.cursor.executemany(Target.query, records)
+        rows = len(records)
     except mysql.Error as err:
-        if err.errno == mysql.errorcode.ER_ACCESS_DENIED_ERROR:
-            logger.error('Bad database "%s" credentials', config['database'])
-        elif err.errno == mysql.errorcode.ER_BAD_DB_ERROR:
-            logger.error('Database "%s" does not exist', config['database'])
-        else:
+        logger.debug('%s, inserting rows one by one', err)
+        for record in records:
+            try:
+                Target.cursor.execute(Target.query, record)
+                rows += 1
+            except mysql.Error as err:
+                Batch.errors += 1
+                logger.error(err)
+    Batch.batches += 1
+    if Batch.batches % max(cmdline.commit, 1) == 0:
+        try:
+            Target.conn.commit()
+        except mysql.Error as err:
+            Batch.errors += 1
             logger.error(err)
-        raise
+    return rows
 
 
 def target_open() -> bool:
@@ -421,13 +1013,34 @@ def target_open() -> bool:
     Target.database = db.target_config['database']
     if Target.conn is None:
         try:
-            Target.conn = connect_db(db.target_config)
+            Target.conn = dbpool.connect('target')
         except Exception:
             logger.error(
                 'Cannot connect to the target database "%s"',
                 Target.database,
                 )
             return False
+    return True
+
+
+def target_prepare() -> bool:
+    """Prepare the target table or its copy for loading.
+
+    Returns
+    -------
+    boolean
+        Flag about successful processing.
+
+    """
+    # Load a copy of the target table
+    Target.load = Target.table
+    if cmdline.shadow:
+        try:
+            Target.load = dbpool.shadow_create(Target.conn, Target.table)
+        except mysql.Error as err:
+            logger.error(err)
+            return False
+        return True
     # Truncate target table
     Target.query = sql.compose_truncate(Target.table)
     Target.cursor = Target.conn.cursor()
@@ -443,6 +1056,44 @@ def target_open() -> bool:
     return True
 
 
+def target_swap() -> bool:
+    """Replace the target table with its loaded copy.
+
+    Returns
+    -------
+    boolean
+        Flag about successful processing.
+
+    """
+    if Target.load == Target.table:
+        return True
+    try:
+        dbpool.shadow_swap(Target.conn, Target.table, Target.load)
+        logger.debug(
+            'Table "%s" replaced with "%s"',
+            Target.table,
+            Target.load,
+        )
+    except mysql.Error as err:
+        logger.error(err)
+        target_drop()
+        return False
+    finally:
+        Target.load = Target.table
+    return True
+
+
+def target_drop():
+    """Drop the loaded copy of the target table."""
+    if Target.load == Target.table:
+        return
+    try:
+        dbpool.drop_table(Target.conn, Target.load)
+    except mysql.Error as err:
+        logger.error(err)
+    Target.load = Target.table
+
+
 def target_close():
     """Close cursor and connection to a target database."""
     # Close cursor
@@ -451,10 +1102,12 @@ def target_close():
     # Close connection to database
     if Target.conn is not None:
         Target.conn.close()
+    dbpool.close()
     Target.conn = None
     Target.query = None
     Target.cursor = None
     Target.table = None
+    Target.load = None
 
 
 ###############################################################################
@@ -480,8 +1133,10 @@ def setup_cmdline():
         help='Migrated agenda.'
     )
     parser.add_argument(
-        'workbook',
-        help='MS Excel workbook file.'
+        'workbooks',
+        nargs='+',
+        help='MS Excel workbook files, CSV or TSV files, or their glob'
+             ' patterns.'
     )
     # Options
     parser.add_argument(
@@ -502,6 +1157,38 @@ def setup_cmdline():
         default=Params.juser,
         help='Joomla! user id for migration, default: ' + str(Params.juser)
     )
+    parser.add_argument(
+        '--shadow',
+        action='store_true',
+        help='Load a copy of the target table and replace the table with it'
+             ' at once instead of truncating it.'
+    )
+    parser.add_argument(
+        '-b', '--batch',
+        type=int,
+        default=Batch.SIZE,
+        help='Number of rows inserted at once, default: '
+             + str(Batch.SIZE)
+    )
+    parser.add_argument(
+        '--commit',
+        type=int,
+        default=Batch.COMMIT,
+        help='Number of batches inserted in a transaction, default: '
+             + str(Batch.COMMIT)
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=1,
+        help='Number of sheets migrated in parallel processes.'
+    )
+    parser.add_argument(
+        '--encoding',
+        help='Encoding of CSV and TSV files, default: '
+             + ' or '.join(CsvReader.ENCODINGS)
+             + ' detected from the beginning of a file.'
+    )
     # Process command line arguments
     global cmdline
     cmdline = parser.parse_args()
@@ -517,36 +1204,48 @@ def setup_logger():
     logger = logging.getLogger(Script.name)
 
 
+def setup_agenda():
+    """Determine migrated agenda and its target table."""
+    if cmdline.agenda == 'incomes':
+        Source.agenda = Income()
+    Target.table = sql.compose_table(
+        sql.target_table_prefix_agenda,
+        cmdline.agenda)
+
+
 def main():
     """Fundamental control function."""
     setup_params()
     setup_cmdline()
     setup_logger()
-    # Connect to MS Excel workbook
-    if not source_open():
+    # List sheets of MS Excel workbooks
+    sheets = source_sheets(cmdline.workbooks)
+    if not sheets:
         return
-    if cmdline.agenda == 'incomes':
-        Source.agenda = Income()
     # Store agenda parameters
-    Target.table = sql.compose_table(
-        sql.target_table_prefix_agenda,
-        cmdline.agenda)
-    # Migrate sheets of a workbook
-    if target_open():
+    setup_agenda()
+    # Migrate sheets of workbooks
+    if target_open() and target_prepare():
         logger.info(
             'START -- Migration to database table "%s//%s.%s"',
             Target.host,
             Target.database,
             Target.table,
             )
-        for Source.wsheet in list(Source.wbook):
-            migrate_sheet()
+        rows, success = migrate_sheets(sheets)
+        # Keep the target table intact at failure of loading its copy
+        if target_open():
+            if success:
+                target_swap()
+            else:
+                target_drop()
         logger.info(
             'STOP -- Migrated %d rows in total',
-            Params.rows,
+            rows,
             )
     # Close databases
     target_close()
+    source_close()
 
 
 if __name__ == '__main__':